@@ -180,6 +180,8 @@ DYNAMIC_CONFIG_DEF = {
 # --- 全局配置字典 ---
 # 其他模块可以通过 from config_manager import APP_CONFIG 来访问
 APP_CONFIG: Dict[str, Any] = {}
+# 配置版本号：每次加载/保存配置后递增，供热路径上的缓存判断是否需要失效
+CONFIG_VERSION: int = 0
 
 # --- 加载配置 ---
 def load_config():
@@ -189,7 +191,7 @@ def load_config():
     2. 使用启动配置连接数据库。
     3. 从数据库 app_settings 表加载动态应用配置。
     """
-    global APP_CONFIG
+    global APP_CONFIG, CONFIG_VERSION
     
     # ======================================================================
     # 阶段 1: 加载启动配置 (从 config.ini 和环境变量)
@@ -277,6 +279,7 @@ def load_config():
         default_dynamic_config = {key: default for key, (section, type, default) in DYNAMIC_CONFIG_DEF.items()}
         APP_CONFIG.update(default_dynamic_config)
 
+    CONFIG_VERSION += 1
     logger.info("  ➜ 所有配置已加载完成。")
     # 函数现在不再需要返回 is_first_run，因为这个状态只在函数内部使用
     # 但为了保持函数签名不变，我们暂时保留它
@@ -287,7 +290,7 @@ def save_config(new_config: Dict[str, Any]):
     """
     【V4 - 健壮的合并保存模式】
     """
-    global APP_CONFIG
+    global APP_CONFIG, CONFIG_VERSION
     
     try:
         # 步骤 1: 从数据库加载当前完整的动态配置
@@ -308,6 +311,7 @@ def save_config(new_config: Dict[str, Any]):
         
         # 步骤 5: 更新内存
         APP_CONFIG.update(dynamic_config_to_save)
+        CONFIG_VERSION += 1
         logger.info("  ➜ 动态应用配置已成功合并保存到数据库，内存中的配置已同步。")
         
     except Exception as e:
@@ -14,6 +14,13 @@ import handler.emby as emby
 
 logger = logging.getLogger(__name__)
 
+# 合集数据版本号：合集定义或成员列表被修改时递增，供上层内存缓存判断是否失效
+COLLECTIONS_VERSION = 0
+
+def _bump_collections_version():
+    global COLLECTIONS_VERSION
+    COLLECTIONS_VERSION += 1
+
 def create_custom_collection(name: str, type: str, definition_json: str, allowed_user_ids_json: Optional[str] = None) -> int:
     """ 创建一个新的自定义合集 。"""
     sql = "INSERT INTO custom_collections (name, type, definition_json, allowed_user_ids) VALUES (%s, %s, %s, %s) RETURNING id"
@@ -29,18 +36,43 @@ def create_custom_collection(name: str, type: str, definition_json: str, allowed
         logger.error(f"创建自定义合集 '{name}' 时发生数据库错误: {e}", exc_info=True)
         raise
 
+def _normalize_collection_row(row) -> Dict[str, Any]:
+    """ 将合集行转为 dict，并保证 definition_json 一定是已解码的 dict。"""
+    coll = dict(row)
+    definition = coll.get('definition_json')
+    if isinstance(definition, str):
+        try:
+            definition = json.loads(definition)
+        except ValueError:
+            definition = {}
+    coll['definition_json'] = definition or {}
+    return coll
+
 def get_custom_collection_by_id(collection_id: int) -> Optional[Dict[str, Any]]:
-    """ 根据ID获取单个自定义合集的详细信息。"""
+    """ 根据ID获取单个自定义合集的详细信息 (definition_json 已解码为 dict)。"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM custom_collections WHERE id = %s", (collection_id,))
             row = cursor.fetchone()
-            return dict(row) if row else None
+            return _normalize_collection_row(row) if row else None
     except psycopg2.Error as e:
         logger.error(f"根据ID {collection_id} 获取自定义合集时出错: {e}", exc_info=True)
         return None
 
+def get_custom_collections_by_ids(collection_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """ 根据ID列表批量获取自定义合集，返回 {id: 合集} (definition_json 已解码为 dict)。"""
+    if not collection_ids:
+        return {}
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM custom_collections WHERE id = ANY(%s)", (list(collection_ids),))
+            return {row['id']: _normalize_collection_row(row) for row in cursor.fetchall()}
+    except psycopg2.Error as e:
+        logger.error(f"批量获取自定义合集 {collection_ids} 时出错: {e}", exc_info=True)
+        return {}
+
 def get_all_custom_collections() -> List[Dict[str, Any]]:
     """ 获取所有自定义合集的基础定义。"""
     try:
@@ -75,6 +107,7 @@ def update_custom_collection(collection_id: int, name: str, type: str, definitio
             cursor = conn.cursor()
             # ★★★ 2. 在执行时传入新参数 ★★★
             cursor.execute(sql, (name, type, definition_json, status, allowed_user_ids_json, collection_id))
+            _bump_collections_version()
             return cursor.rowcount > 0
     except psycopg2.Error as e:
         logger.error(f"更新自定义合集 ID {collection_id} 时出错: {e}", exc_info=True)
@@ -86,6 +119,7 @@ def delete_custom_collection(collection_id: int) -> bool:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM custom_collections WHERE id = %s", (collection_id,))
+            _bump_collections_version()
             return cursor.rowcount > 0
     except psycopg2.Error as e:
         logger.error(f"删除自定义合集 (ID: {collection_id}) 时出错: {e}", exc_info=True)
@@ -133,6 +167,7 @@ def update_custom_collection_sync_results(collection_id: int, update_data: Dict[
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(sql, tuple(values))
+            _bump_collections_version()
     except psycopg2.Error as e:
         logger.error(f"更新自定义合集 {collection_id} 的同步结果时出错: {e}", exc_info=True)
         raise
@@ -212,6 +247,7 @@ def apply_and_persist_media_correction(collection_id: int, old_tmdb_id: Optional
                 "UPDATE custom_collections SET definition_json = %s, generated_media_info_json = %s WHERE id = %s", 
                 (json.dumps(definition, ensure_ascii=False), json.dumps(definition_list, ensure_ascii=False), collection_id)
             )
+            _bump_collections_version()
             
             # === Part 6: 状态继承与新媒体入库 (核心逻辑) ===
             
@@ -574,6 +610,7 @@ def match_and_update_list_collections_on_item_add(new_item_tmdb_id: str, new_ite
                                 in_library_count = %s
                             WHERE id = %s
                         """, (new_json_data, new_in_library_count, collection_id))
+                        _bump_collections_version()
                         
                         logger.info(f"  ➜ 已全量刷新榜单合集《{collection_name}》的缓存，当前入库: {new_in_library_count}。")
                         
@@ -135,51 +135,20 @@ def _build_rating_value_sql(rating_expr: str) -> str:
 
     return f"CASE {chr(10).join(whens)} ELSE {else_logic} END"
 
-def query_virtual_library_items(
-    rules: List[Dict[str, Any]], 
-    logic: str, 
+def _build_virtual_library_where(
+    rules: List[Dict[str, Any]],
+    logic: str,
     user_id: Optional[str],
-    limit: int = 50, 
-    offset: int = 0,
-    sort_by: str = 'DateCreated',
-    sort_order: str = 'Descending',
     item_types: List[str] = None,
     target_library_ids: List[str] = None,
     tmdb_ids: List[str] = None,
-    max_rating_override: Optional[int] = None  
-) -> Tuple[List[Dict[str, Any]], int]:
+    max_rating_override: Optional[int] = None
+) -> Tuple[str, List[Any]]:
     """
-    【核心函数】根据筛选规则 + 用户实时权限，查询媒体项。
+    构建虚拟库筛选的 WHERE 子句 (不含 WHERE 关键字) 及其参数。
+    user_id 非空时子句会引用 u (emby_users)，调用方需自行 JOIN 并把 user_id 参数放在最前。
     """
-    
-    # 1. 基础 SQL 结构
-    if user_id:
-        base_select = """
-            SELECT 
-                m.emby_item_ids_json->>0 as emby_id,
-                m.tmdb_id
-            FROM media_metadata m
-            JOIN emby_users u ON u.id = %s
-        """
-        base_count = """
-            SELECT COUNT(*) 
-            FROM media_metadata m
-            JOIN emby_users u ON u.id = %s
-        """
-        params = [user_id]
-    else:
-        base_select = """
-            SELECT 
-                m.emby_item_ids_json->>0 as emby_id,
-                m.tmdb_id
-            FROM media_metadata m
-        """
-        base_count = """
-            SELECT COUNT(*) 
-            FROM media_metadata m
-        """
-        params = []
-
+    params = []
     where_clauses = []
 
     # 2. 必须在库中
@@ -673,7 +642,64 @@ def query_virtual_library_items(
         where_clauses.append(combined_rules)
 
     # 7. 最终 WHERE 组装
-    full_where = " AND ".join(where_clauses)
+    return " AND ".join(where_clauses), params
+
+def query_virtual_library_items(
+    rules: List[Dict[str, Any]], 
+    logic: str, 
+    user_id: Optional[str],
+    limit: int = 50, 
+    offset: int = 0,
+    sort_by: str = 'DateCreated',
+    sort_order: str = 'Descending',
+    item_types: List[str] = None,
+    target_library_ids: List[str] = None,
+    tmdb_ids: List[str] = None,
+    max_rating_override: Optional[int] = None  
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    【核心函数】根据筛选规则 + 用户实时权限，查询媒体项。
+    返回 (items, total_count)，items 形如 [{'Id': str, 'tmdb_id': str}, ...]，
+    两个 ID 均直接取自 TEXT 列，调用方无需再做 str() 转换。
+    """
+    
+    # 1. 基础 SQL 结构
+    if user_id:
+        base_select = """
+            SELECT 
+                m.emby_item_ids_json->>0 as emby_id,
+                m.tmdb_id
+            FROM media_metadata m
+            JOIN emby_users u ON u.id = %s
+        """
+        base_count = """
+            SELECT COUNT(*) 
+            FROM media_metadata m
+            JOIN emby_users u ON u.id = %s
+        """
+        params = [user_id]
+    else:
+        base_select = """
+            SELECT 
+                m.emby_item_ids_json->>0 as emby_id,
+                m.tmdb_id
+            FROM media_metadata m
+        """
+        base_count = """
+            SELECT COUNT(*) 
+            FROM media_metadata m
+        """
+        params = []
+
+    # 2~7. 筛选条件 (类型/榜单/媒体库/权限/规则)
+    full_where, where_params = _build_virtual_library_where(
+        rules, logic, user_id,
+        item_types=item_types,
+        target_library_ids=target_library_ids,
+        tmdb_ids=tmdb_ids,
+        max_rating_override=max_rating_override
+    )
+    params.extend(where_params)
     
     # 8. 排序映射
     sort_map = {
@@ -729,6 +755,71 @@ def query_virtual_library_items(
         logger.error(f"实时筛选查询失败: {e}", exc_info=True)
         return [], 0
 
+def query_virtual_library_items_union(
+    collection_defs: List[Dict[str, Any]],
+    user_id: Optional[str],
+    limit: int = 20
+) -> List[Dict[str, Any]]:
+    """
+    一条 SQL 聚合多个合集的最新项目 (全局“最新”用)。
+    collection_defs 每项包含 rules / logic / item_types / target_library_ids / tmdb_ids，
+    各合集子查询先按入库时间各取前 limit 条，再 UNION ALL 去重、整体排序并截取 limit 条。
+    返回按 date_added 倒序的 [{'Id': str, 'tmdb_id': str}, ...]。
+    """
+    if not collection_defs or limit <= 0:
+        return []
+
+    if user_id:
+        branch_select = """
+            SELECT m.emby_item_ids_json->>0 AS emby_id, m.tmdb_id, m.date_added
+            FROM media_metadata m
+            JOIN emby_users u ON u.id = %s
+        """
+    else:
+        branch_select = """
+            SELECT m.emby_item_ids_json->>0 AS emby_id, m.tmdb_id, m.date_added
+            FROM media_metadata m
+        """
+
+    branches = []
+    params = []
+    for coll_def in collection_defs:
+        where_sql, where_params = _build_virtual_library_where(
+            coll_def.get('rules', []), coll_def.get('logic', 'AND'), user_id,
+            item_types=coll_def.get('item_types'),
+            target_library_ids=coll_def.get('target_library_ids'),
+            tmdb_ids=coll_def.get('tmdb_ids')
+        )
+        branches.append(f"""
+            ({branch_select}
+            WHERE {where_sql}
+            ORDER BY m.date_added DESC NULLS LAST
+            LIMIT %s)
+        """)
+        if user_id:
+            params.append(user_id)
+        params.extend(where_params)
+        params.append(limit)
+
+    final_query_sql = f"""
+        SELECT t.emby_id, MIN(t.tmdb_id) AS tmdb_id
+        FROM ({" UNION ALL ".join(branches)}) t
+        WHERE t.emby_id IS NOT NULL
+        GROUP BY t.emby_id
+        ORDER BY MAX(t.date_added) DESC NULLS LAST
+        LIMIT %s
+    """
+    params.append(limit)
+
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(final_query_sql, tuple(params))
+                return [{'Id': row['emby_id'], 'tmdb_id': row['tmdb_id']} for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"合集聚合最新查询失败: {e}", exc_info=True)
+        return []
+
 def get_sorted_and_paginated_ids(
     item_ids: List[str], 
     sort_by: str, 
@@ -178,10 +178,10 @@ class P115CookieClient:
                 raise
 
     def download_url(self, pick_code, user_agent=None):
-        """获取直链 (仅 Cookie 可用)"""
+        """获取直链 (仅 Cookie 可用)；返回 p115client 的 P115URL (str 子类，附带 name 等文件信息)"""
         if self.webapi:
             url_obj = self.webapi.download_url(pick_code, user_agent=user_agent)
-            if url_obj: return str(url_obj)
+            if url_obj: return url_obj
         return None
 
     def get_user_info(self):
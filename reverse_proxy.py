@@ -2,14 +2,21 @@
 
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http.cookiejar import DefaultCookiePolicy
 import re
 import os
 import json
-from flask import Flask, request, Response, redirect, send_file
+from flask import Flask, request, Response, redirect, send_file, stream_with_context
 from urllib.parse import urlparse, urlunparse
 from datetime import datetime, timedelta
 import time
+import threading
 import uuid 
+from itertools import chain
+import heapq
+from operator import methodcaller
 from flask import send_file 
 from handler.poster_generator import get_missing_poster
 from gevent import spawn, joinall
@@ -23,6 +30,22 @@ from routes.p115 import _get_cached_115_url
 
 import extensions
 import handler.emby as emby
+
+# orjson 为可选依赖：直接输出 bytes，序列化大列表时明显快于标准库 json
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+# msgpack 为可选依赖：客户端在 Accept 中声明 application/msgpack 时，大列表响应改用更紧凑的二进制格式
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 logger = logging.getLogger(__name__)
 
 MISSING_ID_PREFIX = "-800000_"
@@ -40,20 +63,174 @@ MIMICKED_ID_BASE = 900000
 def to_mimicked_id(db_id): return str(-(MIMICKED_ID_BASE + db_id))
 def from_mimicked_id(mimicked_id): return -(int(mimicked_id)) - MIMICKED_ID_BASE
 def is_mimicked_id(item_id):
-    try: return isinstance(item_id, str) and item_id.startswith('-')
-    except: return False
+    return isinstance(item_id, str) and item_id[:1] == '-'
 MIMICKED_ITEMS_RE = re.compile(r'/emby/Users/([^/]+)/Items/(-(\d+))')
 MIMICKED_ITEM_DETAILS_RE = re.compile(r'emby/Users/([^/]+)/Items/(-(\d+))$')
 
+# Emby 项目按 DateCreated 排序的 key (C 实现，缺失字段按空串处理)
+_DATE_CREATED_KEY = methodcaller('get', 'DateCreated', '')
+
+# AI 推荐候选池缓存：key -> (过期时间戳, tmdb_ids_filter)
+# 翻页/滚动时复用同一批候选 ID，避免每页都重新计算向量，同时保证分页结果一致
+_AI_CACHE = {}
+AI_CACHE_TTL = 600
+
+def _get_ai_tmdb_ids_filter(collection_type, user_id, item_types):
+    """
+    获取 AI 推荐合集的 TMDb ID 过滤列表 (带 TTL 缓存)。
+    """
+    types_key = tuple(sorted(item_types)) if isinstance(item_types, list) else (item_types,)
+    cache_key = (user_id if collection_type == 'ai_recommendation' else 'global', types_key)
+
+    cached = _AI_CACHE.get(cache_key)
+    if cached and cached[0] > time.time():
+        return cached[1]
+
+    api_key = config_manager.APP_CONFIG.get("tmdb_api_key")
+    if not api_key:
+        return None
+
+    engine = RecommendationEngine(api_key)
+    if collection_type == 'ai_recommendation':
+        candidate_pool = engine.generate_user_vector(user_id, limit=300, allowed_types=item_types)
+    else:
+        candidate_pool = engine.generate_global_vector(limit=300, allowed_types=item_types)
+    tmdb_ids_filter = [str(i['id']) for i in candidate_pool]
+
+    _AI_CACHE[cache_key] = (time.time() + AI_CACHE_TTL, tmdb_ids_filter)
+    return tmdb_ids_filter
+
+# 转发时需要剔除的请求头 / 回传时需要剔除的响应头 (均为小写，frozenset 保证 O(1) 查找)
+_EXCLUDED_FWD_HEADERS = frozenset({'host', 'accept-encoding'})
+_EXCLUDED_RESP_HEADERS = frozenset({'content-encoding', 'content-length', 'transfer-encoding', 'connection'})
+
+# 与 Emby 后端通信的持久化会话：复用 TCP/TLS 连接，避免每个代理请求都重新握手
+_emby_session = requests.Session()
+_emby_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=256, max_retries=Retry(total=1, backoff_factor=0.1))
+_emby_session.mount('http://', _emby_adapter)
+_emby_session.mount('https://', _emby_adapter)
+# 代理同时服务多个用户，禁止会话在请求之间保存/回传 Cookie
+_emby_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+# (配置版本号, (base_url, api_key), netloc)，配置保存后版本号变化即自动失效
+_CONFIG_CACHE = (None, None, None)
+
+def _get_emby_config_cache():
+    global _CONFIG_CACHE
+    version = config_manager.CONFIG_VERSION
+    if _CONFIG_CACHE[0] != version:
+        base_url = config_manager.APP_CONFIG.get("emby_server_url", "").rstrip('/')
+        api_key = config_manager.APP_CONFIG.get("emby_api_key", "")
+        if not base_url or not api_key: raise ValueError("Emby服务器地址或API Key未配置")
+        _CONFIG_CACHE = (version, (base_url, api_key), urlparse(base_url).netloc)
+    return _CONFIG_CACHE
+
 def _get_real_emby_url_and_key():
-    base_url = config_manager.APP_CONFIG.get("emby_server_url", "").rstrip('/')
-    api_key = config_manager.APP_CONFIG.get("emby_api_key", "")
-    if not base_url or not api_key: raise ValueError("Emby服务器地址或API Key未配置")
-    return base_url, api_key
+    return _get_emby_config_cache()[1]
+
+def _get_real_emby_host():
+    """ 返回 Emby 服务器的 netloc (用于转发时的 Host 头)，随配置版本缓存。"""
+    return _get_emby_config_cache()[2]
+
+# 合集过滤 ID 缓存：coll_id -> (过期时间戳, 合集数据版本号, 过滤 ID 列表)
+# “最新”视图会被多个客户端频繁轮询，短 TTL 内直接复用，合集被修改时按版本号失效
+_FILTER_IDS_CACHE = {}
+_FILTER_IDS_CACHE_LOCK = threading.Lock()
+FILTER_IDS_CACHE_TTL = 30
+
+def _build_collection_filter_ids(coll_data):
+    c_type = coll_data.get('type')
+    # 1. 榜单类：必须限制在榜单包含的 TMDb ID 范围内
+    if c_type == 'list':
+        raw_json = coll_data.get('generated_media_info_json')
+        raw_list = _json_loads(raw_json) if isinstance(raw_json, str) else (raw_json or [])
+        return [str(i.get('tmdb_id')) for i in raw_list if i.get('tmdb_id')]
+    # 2. AI 推荐类：暂不支持“最新”视图 (因为是动态生成的)，返回一个不存在的 ID 防止泄露
+    elif c_type in ['ai_recommendation', 'ai_recommendation_global']:
+        return ["-1"] 
+    # 3. 规则类：返回 None，表示不限制 ID，只走 Rules
+    return None
+
+def get_collection_filter_ids(coll_data):
+    """
+    获取合集的 TMDb ID 过滤器 (带 TTL + 版本号缓存)。
+    """
+    coll_id = coll_data.get('id')
+    version = custom_collection_db.COLLECTIONS_VERSION
+    now = time.time()
+    with _FILTER_IDS_CACHE_LOCK:
+        cached = _FILTER_IDS_CACHE.get(coll_id)
+    if cached and cached[0] > now and cached[1] == version:
+        return cached[2]
+
+    filter_ids = _build_collection_filter_ids(coll_data)
+    with _FILTER_IDS_CACHE_LOCK:
+        _FILTER_IDS_CACHE[coll_id] = (now + FILTER_IDS_CACHE_TTL, version, filter_ids)
+    return filter_ids
+
+def _stream_json_array(items):
+    """
+    以流的方式逐项输出 JSON 数组，避免一次性拼出整个大字符串，尽早返回首字节。
+    """
+    def generate():
+        yield b'['
+        for index, item in enumerate(items):
+            if index:
+                yield b','
+            yield _json_dumps(item)
+        yield b']'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+def _items_list_response(items):
+    """
+    返回项目列表：客户端声明接受 application/msgpack 且已安装 msgpack 时返回 MessagePack，
+    否则按 JSON 数组流式输出，外部客户端不受影响。
+    响应体随 Accept 变化，两种响应都带 Vary: Accept，防止中间缓存把 MessagePack 返回给 JSON 客户端。
+    """
+    if msgpack is not None and 'application/msgpack' in request.headers.get('Accept', ''):
+        resp = Response(msgpack.packb(items, use_bin_type=True), mimetype='application/msgpack')
+    else:
+        resp = _stream_json_array(items)
+    resp.vary.add('Accept')
+    return resp
+
+# 透传上游响应体时每次读取的块大小 (视频流场景下大块读取可显著减少 Python 层循环次数)
+STREAM_CHUNK_SIZE = 65536
+
+def _iter_upstream_body(resp):
+    """
+    直接从底层 urllib3 连接按大块读取上游响应体，跳过 iter_content 的逐块包装。
+    转发时已要求上游 Accept-Encoding: identity，正常情况下不会发生解压；
+    保留 decode_content=True 仅为上游无视该头时兜底，避免把压缩数据原样发给客户端。
+    """
+    return resp.raw.stream(STREAM_CHUNK_SIZE, decode_content=True)
 
-def _fetch_items_in_chunks(base_url, api_key, user_id, item_ids, fields):
+def _build_forward_headers(identity_encoding=False):
+    """
+    构造转发给 Emby 的请求头：排除集合里的键已预先小写，Host 替换为真实 Emby 地址；
+    流式转发时要求上游不压缩。
+    (requests 的 Session 合并请求头时要求 Mapping，因此这里仍返回 dict 而非 list of tuples)
+    """
+    forward_headers = {k: v for k, v in request.headers.items() if k.lower() not in _EXCLUDED_FWD_HEADERS}
+    forward_headers['Host'] = _get_real_emby_host()
+    if identity_encoding:
+        forward_headers['Accept-Encoding'] = 'identity'
+    return forward_headers
+
+def _build_forward_params(api_key):
+    """
+    构造转发给 Emby 的查询参数：直接展开为普通 dict 并注入 api_key，省去 MultiDict.copy() 的逐值重新包装。
+    仅当存在重复键 (Emby 客户端极少使用) 时才退回列表形式，保证多值参数原样转发。
+    """
+    args = request.args
+    if any(len(values) > 1 for values in args.listvalues()):
+        return {**args.to_dict(flat=False), 'api_key': api_key}
+    return {**args.to_dict(flat=True), 'api_key': api_key}
+
+def _fetch_items_in_chunks(base_url, api_key, user_id, item_ids, fields, preserve_order=False):
     """
     并发分块获取 Emby 项目详情。
+    preserve_order=True 时按传入的 item_ids 顺序返回 (Emby 未返回的项目会被剔除)。
     """
     if not item_ids: return []
     
@@ -70,9 +247,9 @@ def _fetch_items_in_chunks(base_url, api_key, user_id, item_ids, fields):
     def fetch_chunk(chunk):
         params = {'api_key': api_key, 'Ids': ",".join(chunk), 'Fields': fields}
         try:
-            resp = requests.get(target_url, params=params, timeout=20)
+            resp = _emby_session.get(target_url, params=params, timeout=20)
             resp.raise_for_status()
-            return resp.json().get("Items", [])
+            return _json_loads(resp.content).get("Items", [])
         except Exception as e:
             logger.error(f"并发获取某分块数据时失败: {e}")
             return None
@@ -80,20 +257,32 @@ def _fetch_items_in_chunks(base_url, api_key, user_id, item_ids, fields):
     greenlets = [spawn(fetch_chunk, chunk) for chunk in id_chunks]
     joinall(greenlets)
     
-    all_items = []
-    for g in greenlets:
-        if g.value: all_items.extend(g.value)
-        
-    return all_items
+    all_items = chain.from_iterable(g.value for g in greenlets if g.value)
+    if not preserve_order:
+        return list(all_items)
+
+    # Emby 通常按 Ids 参数的顺序返回且无缺项，此时直接使用，省去建映射表和重排
+    items = list(all_items)
+    if len(items) == len(unique_ids) and all(item.get('Id') == i for item, i in zip(items, unique_ids)):
+        return items
 
-def _fetch_sorted_items_via_emby_proxy(user_id, item_ids, sort_by, sort_order, limit, offset, fields, total_record_count):
+    items_map = {item['Id']: item for item in items}
+    return [x for x in (items_map.get(i) for i in unique_ids) if x is not None]
+
+def _fetch_sorted_items_via_emby_proxy(user_id, item_ids, sort_by, sort_order, limit, offset, fields, total_record_count, presorted=False):
     """
     [榜单类专用] 
     当我们需要对一组固定的 ID (来自榜单) 进行排序和分页时使用。
     利用 Emby 的 GET 请求能力，让 Emby 帮我们过滤权限并排序。
     如果 ID 太多，回退到内存排序。
+    presorted=True 表示 item_ids 已按 sort_by 排好序 (如 SQL 已按 DateCreated 排序)，
+    此时若一页就能装下全部 ID，直接按原顺序取详情，省去 Emby 端排序。
     """
     base_url, api_key = _get_real_emby_url_and_key()
+
+    if presorted and offset == 0 and limit >= len(item_ids):
+        ordered_items = _fetch_items_in_chunks(base_url, api_key, user_id, item_ids, fields, preserve_order=True)
+        return {"Items": ordered_items, "TotalRecordCount": len(ordered_items)}
     
     # 估算 URL 长度
     estimated_ids_length = len(item_ids) * 33 # GUID 长度 + 逗号
@@ -102,22 +291,22 @@ def _fetch_sorted_items_via_emby_proxy(user_id, item_ids, sort_by, sort_order, l
     try:
         if estimated_ids_length < URL_LENGTH_THRESHOLD:
             # --- 路径 A: ID列表较短，直接请求 Emby (最快，且自动处理权限) ---
-            logger.trace(f"  ➜ [Emby 代理排序] ID列表较短 ({len(item_ids)}个)，使用 GET 方法。")
+            logger.trace("  ➜ [Emby 代理排序] ID列表较短 (%d个)，使用 GET 方法。", len(item_ids))
             target_url = f"{base_url}/emby/Users/{user_id}/Items"
             emby_params = {
                 'api_key': api_key, 'Ids': ",".join(item_ids), 'Fields': fields,
                 'SortBy': sort_by, 'SortOrder': sort_order,
                 'StartIndex': offset, 'Limit': limit,
             }
-            resp = requests.get(target_url, params=emby_params, timeout=25)
+            resp = _emby_session.get(target_url, params=emby_params, timeout=25)
             resp.raise_for_status()
-            emby_data = resp.json()
+            emby_data = _json_loads(resp.content)
             # 注意：Emby 返回的 TotalRecordCount 是经过权限过滤后的数量
             # 如果我们传入的 total_record_count 是全量的，这里可能需要修正，但为了分页条正常，通常直接用 Emby 返回的
             return emby_data
         else:
             # --- 路径 B: ID列表超长，内存排序 (安全回退) ---
-            logger.trace(f"  ➜ [内存排序回退] ID列表超长 ({len(item_ids)}个)，启动内存排序。")
+            logger.trace("  ➜ [内存排序回退] ID列表超长 (%d个)，启动内存排序。", len(item_ids))
             
             # 1. 获取所有项目的详情 (Emby 会自动过滤掉无权访问的项目)
             # 我们需要获取用于排序的字段
@@ -247,7 +436,7 @@ def handle_get_views():
             final_items.extend(fake_views_items)
 
         final_response = {"Items": final_items, "TotalRecordCount": len(final_items)}
-        return Response(json.dumps(final_response), mimetype='application/json')
+        return Response(_json_dumps(final_response), mimetype='application/json')
         
     except Exception as e:
         logger.error(f"[PROXY] 获取视图数据时出错: {e}", exc_info=True)
@@ -263,7 +452,7 @@ def handle_get_mimicked_library_details(user_id, mimicked_id):
         real_emby_collection_id = coll.get('emby_collection_id')
         image_tags = {"Primary": real_emby_collection_id} if real_emby_collection_id else {}
         
-        definition = coll.get('definition_json') or {}
+        definition = coll['definition_json']
         item_type_from_db = definition.get('item_type', 'Movie')
         collection_type = "mixed"
         if not (isinstance(item_type_from_db, list) and len(item_type_from_db) > 1):
@@ -275,7 +464,7 @@ def handle_get_mimicked_library_details(user_id, mimicked_id):
             "Type": "CollectionFolder",
             "CollectionType": collection_type, "IsFolder": True, "ImageTags": image_tags,
         }
-        return Response(json.dumps(fake_library_details), mimetype='application/json')
+        return Response(_json_dumps(fake_library_details), mimetype='application/json')
     except Exception as e:
         logger.error(f"获取伪造库详情时出错: {e}", exc_info=True)
         return "Internal Server Error", 500
@@ -288,14 +477,21 @@ def handle_get_mimicked_library_image(path):
         base_url, _ = _get_real_emby_url_and_key()
         image_url = f"{base_url}/Items/{real_emby_collection_id}/Images/Primary"
         headers = {key: value for key, value in request.headers if key.lower() != 'host'}
-        headers['Host'] = urlparse(base_url).netloc
-        resp = requests.get(image_url, headers=headers, stream=True, params=request.args)
-        excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-        response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in excluded_headers]
+        headers['Host'] = _get_real_emby_host()
+        resp = _emby_session.get(image_url, headers=headers, stream=True, params=request.args)
+        response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in _EXCLUDED_RESP_HEADERS]
         return Response(resp.iter_content(chunk_size=8192), resp.status_code, response_headers)
     except Exception as e:
         return "Internal Proxy Error", 500
 
+# 缺失项目占位符的固定字段，逐项 copy 后只填充每个项目不同的字段
+_PLACEHOLDER_TEMPLATE = {
+    "HasPrimaryImage": True,
+    "PrimaryImageAspectRatio": 0.6666666666666666,
+    "UserData": {"PlaybackPositionTicks": 0, "PlayCount": 0, "IsFavorite": False, "Played": False},
+    "LocationType": "Virtual"
+}
+
 UNSUPPORTED_METADATA_ENDPOINTS = [
         # '/Items/Prefixes', # Emby 不支持按前缀过滤虚拟库
         '/Genres',         
@@ -305,38 +501,46 @@ UNSUPPORTED_METADATA_ENDPOINTS = [
         '/Years'           
     ]
 
+# 预编译的后缀匹配：元数据端点 (拦截 F 入口) 与其中直接返回空列表的端点，各一次正则搜索完成
+_UNSUPPORTED_METADATA_ENDPOINT_RE = re.compile(
+    '(?:' + '|'.join(re.escape(e) for e in UNSUPPORTED_METADATA_ENDPOINTS) + ')$'
+)
+_METADATA_ENDPOINT_RE = re.compile(
+    '(?:' + '|'.join(re.escape(e) for e in dict.fromkeys(UNSUPPORTED_METADATA_ENDPOINTS + ['/Items/Prefixes', '/Genres', '/Studios', '/Tags', '/OfficialRatings', '/Years'])) + ')$'
+)
+
 def handle_mimicked_library_metadata_endpoint(path, mimicked_id, params):
     """
     处理虚拟库的元数据请求。
     """
-    if any(path.endswith(endpoint) for endpoint in UNSUPPORTED_METADATA_ENDPOINTS):
-        return Response(json.dumps([]), mimetype='application/json')
+    if _UNSUPPORTED_METADATA_ENDPOINT_RE.search(path):
+        return Response(_json_dumps([]), mimetype='application/json')
 
     try:
         real_db_id = from_mimicked_id(mimicked_id)
         collection_info = custom_collection_db.get_custom_collection_by_id(real_db_id)
         if not collection_info or not collection_info.get('emby_collection_id'):
-            return Response(json.dumps([]), mimetype='application/json')
+            return Response(_json_dumps([]), mimetype='application/json')
 
         real_emby_collection_id = collection_info.get('emby_collection_id')
         base_url, api_key = _get_real_emby_url_and_key()
         target_url = f"{base_url}/{path}"
         
         headers = {k: v for k, v in request.headers if k.lower() not in ['host']}
-        headers['Host'] = urlparse(base_url).netloc
+        headers['Host'] = _get_real_emby_host()
         
         new_params = params.copy()
         new_params['ParentId'] = real_emby_collection_id
         new_params['api_key'] = api_key
         
-        resp = requests.get(target_url, headers=headers, params=new_params, timeout=15)
+        resp = _emby_session.get(target_url, headers=headers, params=new_params, timeout=15)
         resp.raise_for_status()
         
         return Response(resp.content, resp.status_code, content_type=resp.headers.get('Content-Type'))
 
     except Exception as e:
         logger.error(f"处理虚拟库元数据请求 '{path}' 时出错: {e}", exc_info=True)
-        return Response(json.dumps([]), mimetype='application/json')
+        return Response(_json_dumps([]), mimetype='application/json')
     
 def handle_get_mimicked_library_items(user_id, mimicked_id, params):
     """
@@ -348,12 +552,9 @@ def handle_get_mimicked_library_items(user_id, mimicked_id, params):
         real_db_id = from_mimicked_id(mimicked_id)
         collection_info = custom_collection_db.get_custom_collection_by_id(real_db_id)
         if not collection_info:
-            return Response(json.dumps({"Items": [], "TotalRecordCount": 0}), mimetype='application/json')
+            return Response(_json_dumps({"Items": [], "TotalRecordCount": 0}), mimetype='application/json')
 
-        definition = collection_info.get('definition_json') or {}
-        if isinstance(definition, str):
-            try: definition = json.loads(definition)
-            except: definition = {}
+        definition = collection_info['definition_json']
 
         collection_type = collection_info.get('type')
         
@@ -406,11 +607,22 @@ def handle_get_mimicked_library_items(user_id, mimicked_id, params):
         if collection_type == 'list':
             show_placeholders = config_manager.APP_CONFIG.get(constants.CONFIG_OPTION_PROXY_SHOW_MISSING_PLACEHOLDERS, False)
             raw_list_json = collection_info.get('generated_media_info_json')
-            raw_list = json.loads(raw_list_json) if isinstance(raw_list_json, str) else (raw_list_json or [])
+            raw_list = _json_loads(raw_list_json) if isinstance(raw_list_json, str) else (raw_list_json or [])
             
             if raw_list:
+                # 0. 预清洗：一次性规整为 (tmdb_id, emby_id) 元组，缺失值统一为 None
+                cleaned_list = []
+                for raw_item in raw_list:
+                    tid = raw_item.get('tmdb_id')
+                    eid = raw_item.get('emby_id')
+                    tid = str(tid) if tid and str(tid).lower() != 'none' else None
+                    eid = str(eid) if eid and str(eid).lower() != 'none' else None
+                    if tid is None and eid is None:
+                        continue
+                    cleaned_list.append((tid, eid))
+
                 # 1. 获取该榜单中所有涉及的 TMDb ID
-                tmdb_ids_in_list = [str(i.get('tmdb_id')) for i in raw_list if i.get('tmdb_id')]
+                tmdb_ids_in_list = [tid for tid, _ in cleaned_list if tid]
                 
                 # 2. 【用户视图】获取当前用户有权看到的项目
                 items_in_db, _ = queries_db.query_virtual_library_items(
@@ -430,36 +642,30 @@ def handle_get_mimicked_library_items(user_id, mimicked_id, params):
                 )
 
                 # 4. 建立映射表
-                local_tmdb_map = {str(i['tmdb_id']): i['Id'] for i in items_in_db if i.get('tmdb_id')}
-                local_emby_id_set = {str(i['Id']) for i in items_in_db}
+                local_tmdb_map = {i['tmdb_id']: i['Id'] for i in items_in_db if i['tmdb_id']}
+                local_emby_id_set = {i['Id'] for i in items_in_db}
                 
-                global_tmdb_set = {str(i['tmdb_id']) for i in global_existing_items if i.get('tmdb_id')}
-                global_emby_id_set = {str(i['Id']) for i in global_existing_items}
+                global_tmdb_set = {i['tmdb_id'] for i in global_existing_items if i['tmdb_id']}
+                global_emby_id_set = {i['Id'] for i in global_existing_items}
                 
                 # 5. 构造完整视图列表
                 full_view_list = []
-                for raw_item in raw_list:
-                    tid = str(raw_item.get('tmdb_id')) if raw_item.get('tmdb_id') else "None"
-                    eid = str(raw_item.get('emby_id')) if raw_item.get('emby_id') else "None"
-
-                    if (not tid or tid.lower() == "none") and (not eid or eid.lower() == "none"):
-                        continue
-
+                for tid, eid in cleaned_list:
                     if defined_limit and len(full_view_list) >= defined_limit:
                         break
                     
                     # 分支 1: 用户有权查看
-                    if tid != "None" and tid in local_tmdb_map:
+                    if tid and tid in local_tmdb_map:
                         full_view_list.append({"is_missing": False, "id": local_tmdb_map[tid], "tmdb_id": tid})
-                    elif eid != "None" and eid in local_emby_id_set:
+                    elif eid and eid in local_emby_id_set:
                          full_view_list.append({"is_missing": False, "id": eid, "tmdb_id": tid})
 
                     # 分支 3: 项目存在于全局库，但用户无权查看 -> 【跳过，不显示占位符】
-                    elif (tid != "None" and tid in global_tmdb_set) or (eid != "None" and eid in global_emby_id_set):
+                    elif (tid and tid in global_tmdb_set) or (eid and eid in global_emby_id_set):
                         continue 
 
                     # 分支 4: 项目确实缺失 -> 显示占位符
-                    elif tid != "None":
+                    elif tid:
                         if show_placeholders:
                             full_view_list.append({"is_missing": True, "tmdb_id": tid})
 
@@ -479,6 +685,7 @@ def handle_get_mimicked_library_items(user_id, mimicked_id, params):
                 emby_map = {item['Id']: item for item in emby_details}
 
                 final_items = []
+                server_id = extensions.EMBY_SERVER_ID
                 for entry in paged_part:
                     if not entry['is_missing']:
                         eid = entry['id']
@@ -491,19 +698,15 @@ def handle_get_mimicked_library_items(user_id, mimicked_id, params):
                         status = meta.get('subscription_status', 'WANTED')
                         db_item_type = meta.get('item_type', 'Movie')
                         
-                        placeholder = {
-                            "Name": meta.get('title', '未知内容'),
-                            "ServerId": extensions.EMBY_SERVER_ID,
-                            "Id": to_missing_item_id(tid),
-                            "Type": db_item_type,
-                            "ProductionYear": int(meta.get('release_year')) if meta.get('release_year') else None,
-                            "ImageTags": {"Primary": f"missing_{status}_{tid}"},
-                            "HasPrimaryImage": True,
-                            "PrimaryImageAspectRatio": 0.6666666666666666,
-                            "UserData": {"PlaybackPositionTicks": 0, "PlayCount": 0, "IsFavorite": False, "Played": False},
-                            "ProviderIds": {"Tmdb": tid},
-                            "LocationType": "Virtual"
-                        }
+                        placeholder = _PLACEHOLDER_TEMPLATE.copy()
+                        placeholder["UserData"] = placeholder["UserData"].copy()
+                        placeholder["Name"] = meta.get('title', '未知内容')
+                        placeholder["ServerId"] = server_id
+                        placeholder["Id"] = to_missing_item_id(tid)
+                        placeholder["Type"] = db_item_type
+                        placeholder["ProductionYear"] = int(meta.get('release_year')) if meta.get('release_year') else None
+                        placeholder["ImageTags"] = {"Primary": f"missing_{status}_{tid}"}
+                        placeholder["ProviderIds"] = {"Tmdb": tid}
                         r_date = meta.get('release_date')
                         r_year = meta.get('release_year')
                         if r_date:
@@ -520,19 +723,12 @@ def handle_get_mimicked_library_items(user_id, mimicked_id, params):
 
                         final_items.append(placeholder)
                 
-                return Response(json.dumps({"Items": final_items, "TotalRecordCount": reported_total_count}), mimetype='application/json')
+                return Response(_json_dumps({"Items": final_items, "TotalRecordCount": reported_total_count}), mimetype='application/json')
 
         # --- 场景 B: 筛选/推荐类 (修复灰色占位符) ---
         else:
             if collection_type in ['ai_recommendation', 'ai_recommendation_global']:
-                api_key = config_manager.APP_CONFIG.get("tmdb_api_key")
-                if api_key:
-                    engine = RecommendationEngine(api_key)
-                    if collection_type == 'ai_recommendation':
-                        candidate_pool = engine.generate_user_vector(user_id, limit=300, allowed_types=item_types)
-                    else:
-                        candidate_pool = engine.generate_global_vector(limit=300, allowed_types=item_types)
-                    tmdb_ids_filter = [str(i['id']) for i in candidate_pool]
+                tmdb_ids_filter = _get_ai_tmdb_ids_filter(collection_type, user_id, item_types)
 
             # 执行 SQL 查询
             sql_limit = defined_limit if is_emby_proxy_sort_required and defined_limit else 5000 if is_emby_proxy_sort_required else min(emby_limit, defined_limit - offset) if (defined_limit and defined_limit > offset) else emby_limit
@@ -550,7 +746,7 @@ def handle_get_mimicked_library_items(user_id, mimicked_id, params):
             reported_total_count = min(total_count, defined_limit) if defined_limit else total_count
 
             if not items:
-                return Response(json.dumps({"Items": [], "TotalRecordCount": reported_total_count}), mimetype='application/json')
+                return Response(_json_dumps({"Items": [], "TotalRecordCount": reported_total_count}), mimetype='application/json')
 
             final_emby_ids = [i['Id'] for i in items]
             full_fields = "PrimaryImageAspectRatio,ImageTags,HasPrimaryImage,ProviderIds,UserData,Name,ProductionYear,CommunityRating,DateCreated,PremiereDate,Type,RecursiveItemCount,SortName,ChildCount,BasicSyncInfo"
@@ -560,15 +756,12 @@ def handle_get_mimicked_library_items(user_id, mimicked_id, params):
                 sorted_data = _fetch_sorted_items_via_emby_proxy(
                     user_id, final_emby_ids, sort_by, sort_order, emby_limit, offset, full_fields, reported_total_count
                 )
-                return Response(json.dumps(sorted_data), mimetype='application/json')
+                return Response(_json_dumps(sorted_data), mimetype='application/json')
             else:
                 # SQL 排序模式：直接获取详情
                 base_url, api_key = _get_real_emby_url_and_key()
-                items_from_emby = _fetch_items_in_chunks(base_url, api_key, user_id, final_emby_ids, full_fields)
-                items_map = {item['Id']: item for item in items_from_emby}
-                
-                # 过滤掉 Emby 实际没有返回的项目
-                final_items = [items_map[eid] for eid in final_emby_ids if eid in items_map]
+                # 过滤掉 Emby 实际没有返回的项目，并保持 SQL 排序
+                final_items = _fetch_items_in_chunks(base_url, api_key, user_id, final_emby_ids, full_fields, preserve_order=True)
                 
                 # --- 修复开始 ---
                 expected_count = len(final_emby_ids)
@@ -578,18 +771,18 @@ def handle_get_mimicked_library_items(user_id, mimicked_id, params):
                     diff = expected_count - actual_count
                     # 1. 先执行原本的减法修正
                     reported_total_count = max(0, reported_total_count - diff)
-                    logger.debug(f"检测到权限过滤导致的数量差异: SQL={expected_count}, Emby={actual_count}. 初步修正 TotalRecordCount 为 {reported_total_count}")
+                    logger.debug("检测到权限过滤导致的数量差异: SQL=%s, Emby=%s. 初步修正 TotalRecordCount 为 %s", expected_count, actual_count, reported_total_count)
 
                     # 2. 【新增】封底保险逻辑
                     if reported_total_count <= emby_limit:
                         reported_total_count = actual_count
-                        logger.debug(f"修正后的总数小于分页限制，强制对齐 TotalRecordCount = {actual_count} 以消除灰块")
+                        logger.debug("修正后的总数小于分页限制，强制对齐 TotalRecordCount = %s 以消除灰块", actual_count)
 
-                return Response(json.dumps({"Items": final_items, "TotalRecordCount": reported_total_count}), mimetype='application/json')
+                return Response(_json_dumps({"Items": final_items, "TotalRecordCount": reported_total_count}), mimetype='application/json')
 
     except Exception as e:
         logger.error(f"处理虚拟库 '{mimicked_id}' 失败: {e}", exc_info=True)
-        return Response(json.dumps({"Items": [], "TotalRecordCount": 0}), mimetype='application/json')
+        return Response(_json_dumps({"Items": [], "TotalRecordCount": 0}), mimetype='application/json')
 
 def handle_get_latest_items(user_id, params):
     """
@@ -603,37 +796,22 @@ def handle_get_latest_items(user_id, params):
         limit = int(params.get('Limit', 20))
         fields = params.get('Fields', "PrimaryImageAspectRatio,BasicSyncInfo,DateCreated,UserData")
 
-        # --- 辅助函数：获取合集的过滤 ID ---
-        def get_collection_filter_ids(coll_data):
-            c_type = coll_data.get('type')
-            # 1. 榜单类：必须限制在榜单包含的 TMDb ID 范围内
-            if c_type == 'list':
-                raw_json = coll_data.get('generated_media_info_json')
-                raw_list = json.loads(raw_json) if isinstance(raw_json, str) else (raw_json or [])
-                return [str(i.get('tmdb_id')) for i in raw_list if i.get('tmdb_id')]
-            # 2. AI 推荐类：暂不支持“最新”视图 (因为是动态生成的)，返回一个不存在的 ID 防止泄露
-            elif c_type in ['ai_recommendation', 'ai_recommendation_global']:
-                return ["-1"] 
-            # 3. 规则类：返回 None，表示不限制 ID，只走 Rules
-            return None
-
         # 场景一：单个虚拟库的最新
         if virtual_library_id and is_mimicked_id(virtual_library_id):
             real_db_id = from_mimicked_id(virtual_library_id)
             collection_info = custom_collection_db.get_custom_collection_by_id(real_db_id)
-            if not collection_info: return Response(json.dumps([]), mimetype='application/json')
+            if not collection_info: return Response(_json_dumps([]), mimetype='application/json')
 
-            definition = collection_info.get('definition_json') or {}
-            if isinstance(definition, str): definition = json.loads(definition)
+            definition = collection_info['definition_json']
             
             if not definition.get('show_in_latest', True):
-                return Response(json.dumps([]), mimetype='application/json')
+                return Response(_json_dumps([]), mimetype='application/json')
 
             # --- 修复核心：获取 ID 过滤器 ---
             tmdb_ids_filter = get_collection_filter_ids(collection_info)
             # 如果是 AI 合集返回了 ["-1"]，或者榜单为空，直接返回空结果
             if tmdb_ids_filter is not None and (len(tmdb_ids_filter) == 0 or tmdb_ids_filter == ["-1"]):
-                 return Response(json.dumps([]), mimetype='application/json')
+                 return Response(_json_dumps([]), mimetype='application/json')
 
             # 确定排序
             item_types = definition.get('item_type', ['Movie'])
@@ -649,25 +827,28 @@ def handle_get_latest_items(user_id, params):
                 tmdb_ids=tmdb_ids_filter  # <--- 传入 TMDb ID 限制
             )
             
-            if not items: return Response(json.dumps([]), mimetype='application/json')
+            if not items: return Response(_json_dumps([]), mimetype='application/json')
             final_emby_ids = [i['Id'] for i in items]
 
             # 统一调用代理排序
             sorted_data = _fetch_sorted_items_via_emby_proxy(
-                user_id, final_emby_ids, sort_by, 'Descending', limit, 0, fields, len(final_emby_ids)
+                user_id, final_emby_ids, sort_by, 'Descending', limit, 0, fields, len(final_emby_ids),
+                presorted=(sort_by == 'DateCreated')
             )
-            return Response(json.dumps(sorted_data.get("Items", [])), mimetype='application/json')
+            return _items_list_response(sorted_data.get("Items", []))
 
         # 场景二：全局最新 (所有可见合集的聚合)
         elif not virtual_library_id:
             # 获取所有开启了“显示最新”的合集 ID
             included_collection_ids = custom_collection_db.get_active_collection_ids_for_latest_view()
             if not included_collection_ids:
-                return Response(json.dumps([]), mimetype='application/json')
+                return Response(_json_dumps([]), mimetype='application/json')
             
-            all_latest = []
+            # 先做权限/过滤器检查，只为需要查询的合集生成查询参数
+            collections_map = custom_collection_db.get_custom_collections_by_ids(included_collection_ids)
+            collection_defs = []
             for coll_id in included_collection_ids:
-                coll = custom_collection_db.get_custom_collection_by_id(coll_id)
+                coll = collections_map.get(coll_id)
                 if not coll: continue
                 
                 # 检查权限
@@ -679,57 +860,294 @@ def handle_get_latest_items(user_id, params):
                 if tmdb_ids_filter is not None and (len(tmdb_ids_filter) == 0 or tmdb_ids_filter == ["-1"]):
                     continue
 
-                definition = coll.get('definition_json')
-                items, _ = queries_db.query_virtual_library_items(
+                definition = coll['definition_json']
+                collection_defs.append(dict(
                     rules=definition.get('rules', []),
                     logic=definition.get('logic', 'AND'),
-                    user_id=user_id,
-                    limit=limit, 
-                    offset=0,
-                    sort_by='DateCreated',
-                    sort_order='Descending',
                     item_types=definition.get('item_type', ['Movie']),
                     target_library_ids=definition.get('target_library_ids', []),
                     tmdb_ids=tmdb_ids_filter # <--- 传入 TMDb ID 限制
-                )
-                all_latest.extend(items)
-            
-            # 去重并获取详情
-            unique_ids = list({i['Id'] for i in all_latest})
-            if not unique_ids: return Response(json.dumps([]), mimetype='application/json')
+                ))
+
+            # 所有合集合并为一条 UNION ALL 查询，由数据库完成去重、按入库时间排序和截取
+            latest_rows = queries_db.query_virtual_library_items_union(collection_defs, user_id, limit)
+            unique_ids = [it['Id'] for it in latest_rows]
+            if not unique_ids: return Response(_json_dumps([]), mimetype='application/json')
             
-            # 批量获取详情
-            items_details = _fetch_items_in_chunks(base_url, api_key, user_id, unique_ids, "DateCreated")
-            # 内存排序
-            items_details.sort(key=lambda x: x.get('DateCreated', ''), reverse=True)
-            # 截取
-            latest_ids = [i['Id'] for i in items_details[:limit]]
+            # 批量获取详情：候选已由 SQL 截取到 limit 条，直接按客户端请求的 Fields 取一次完整详情，
+            # 排序所需的 DateCreated 不在其中时补上，省去只取 DateCreated 后再二次拉取详情
+            detail_fields = fields if 'DateCreated' in fields.split(',') else f"{fields},DateCreated"
+            items_details = _fetch_items_in_chunks(base_url, api_key, user_id, unique_ids, detail_fields)
+            # 以 Emby 的 DateCreated 复核排序并截取 (date_added 缺失的行在 SQL 中排在末尾)
+            # 只需前 limit 条，用堆取 Top-N，避免整表排序
+            top_items = heapq.nlargest(limit, items_details, key=_DATE_CREATED_KEY)
+            return _items_list_response(top_items)
 
         else:
             # 原生库请求，直接转发
             target_url = f"{base_url}/{request.path.lstrip('/')}"
-            forward_headers = {k: v for k, v in request.headers if k.lower() not in ['host', 'accept-encoding']}
-            forward_headers['Host'] = urlparse(base_url).netloc
-            forward_params = request.args.copy()
-            forward_params['api_key'] = api_key
-            resp = requests.request(method=request.method, url=target_url, headers=forward_headers, params=forward_params, data=request.get_data(), stream=True, timeout=30.0)
-            excluded_resp_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-            response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in excluded_resp_headers]
-            return Response(resp.iter_content(chunk_size=8192), resp.status_code, response_headers)
-
-        if not latest_ids:
-            return Response(json.dumps([]), mimetype='application/json')
-
-        # 获取最终详情
-        items_from_emby = _fetch_items_in_chunks(base_url, api_key, user_id, latest_ids, fields)
-        items_map = {item['Id']: item for item in items_from_emby}
-        final_items = [items_map[id] for id in latest_ids if id in items_map]
-        
-        return Response(json.dumps(final_items), mimetype='application/json')
+            forward_headers = _build_forward_headers(identity_encoding=True)
+            forward_params = _build_forward_params(api_key)
+            resp = _emby_session.request(method=request.method, url=target_url, headers=forward_headers, params=forward_params, data=request.get_data(), stream=True, timeout=30.0)
+            response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in _EXCLUDED_RESP_HEADERS]
+            return Response(_iter_upstream_body(resp), resp.status_code, response_headers)
 
     except Exception as e:
         logger.error(f"  ➜ 处理最新媒体时发生未知错误: {e}", exc_info=True)
-        return Response(json.dumps([]), mimetype='application/json')
+        return Response(_json_dumps([]), mimetype='application/json')
+
+def _handle_video_stream(path):
+    """
+    拦截 H: 视频流请求 (stream.mkv, stream.mp4, original.mp4 等)。
+    浏览器直接转发；其他客户端尽量 302 到 115 直链。
+    """
+    # logger.debug("[STREAM] 进入视频流拦截，path=%s", path)
+
+    # 检测浏览器客户端
+    user_agent = request.headers.get('User-Agent', '').lower()
+    client_name = request.headers.get('X-Emby-Client', '').lower()
+    is_browser = 'mozilla' in user_agent or 'chrome' in user_agent or 'safari' in user_agent
+    native_clients = ['androidtv', 'infuse', 'emby for ios', 'emby for android', 'emby theater', 'senplayer']
+    if any(nc in client_name for nc in native_clients) or 'infuse' in user_agent or 'dalvik' in user_agent:
+        is_browser = False
+
+    # 浏览器直接转发给 Emby 服务端，不做 302 重定向（115 直链存在跨域问题）
+    if is_browser:
+        # logger.debug("[STREAM] 识别为浏览器，直接转发给 Emby 服务端，不做 302 重定向")
+        base_url, api_key = _get_real_emby_url_and_key()
+        target_url = f"{base_url}/{path.lstrip('/')}"
+        forward_headers = _build_forward_headers(identity_encoding=True)
+        forward_params = _build_forward_params(api_key)
+        resp = _emby_session.request(method=request.method, url=target_url, headers=forward_headers, params=forward_params, data=request.get_data(), timeout=30.0, stream=True)
+        response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in _EXCLUDED_RESP_HEADERS]
+        return Response(_iter_upstream_body(resp), resp.status_code, response_headers)
+
+    # 客户端才做 302 重定向
+    parts = path.split('/')
+    item_id = parts[2] if len(parts) > 2 else ''
+    play_session_id = request.args.get('PlaySessionId', '')
+
+    real_115_url = None
+    try:
+        base_url, api_key = _get_real_emby_url_and_key()
+        playback_info_url = f"{base_url}/emby/Items/{item_id}/PlaybackInfo"
+        params = {
+            'api_key': api_key,
+            'UserId': request.args.get('UserId', ''),
+            'MaxStreamingBitrate': 140000000,
+            'PlaySessionId': play_session_id,
+        }
+
+        forward_headers = _build_forward_headers()
+
+        resp = _emby_session.get(playback_info_url, params=params, headers=forward_headers, timeout=10)
+
+        if resp.status_code == 200:
+            data = _json_loads(resp.content)
+            for source in data.get('MediaSources', []):
+                strm_url = source.get('Path', '')
+                if isinstance(strm_url, str):
+                    pick_code = None
+                    if '/api/p115/play/' in strm_url:
+                        pick_code = strm_url.split('/play/')[-1].split('?')[0].strip()
+                    else:
+                        # 挂载模式：通过 item_id 查库获取 PC 码
+                        pick_code = media_db.get_pickcode_by_emby_id(item_id)
+
+                    if pick_code:
+                        player_ua = request.headers.get('User-Agent', 'Mozilla/5.0')
+                        client_ip = request.headers.get('X-Real-IP', request.remote_addr)
+                        real_115_url = _get_cached_115_url(pick_code, player_ua, client_ip)
+                        break # <--- 找到直链就跳出循环
+    except Exception as e:
+        logger.error(f"[STREAM] 获取 115 直链失败: {e}")
+
+    # 如果获取到 115 直链，直接 302 重定向！不要用 Python 中转流！
+    # 这样 Infuse 等播放器会自己去连 115，完美支持拖动进度条，且不消耗服务器带宽。
+    if real_115_url:
+        # logger.debug("  ✅ 已 302 跳转重定向到 115 直链")
+        return redirect(real_115_url, code=302)
+
+    # 如果获取失败，回退到原来的转发方式
+    logger.info("[STREAM] 回退到转发模式")
+    target_url = f"{base_url}/{path.lstrip('/')}"
+    forward_headers = _build_forward_headers()
+    forward_params = _build_forward_params(api_key)
+
+    resp = _emby_session.request(method=request.method, url=target_url, headers=forward_headers, params=forward_params, data=request.get_data(), timeout=10, allow_redirects=False)
+
+    if resp.status_code in [301, 302]:
+        redirect_url = resp.headers.get('Location', '')
+        if '/api/p115/play/' in redirect_url:
+            pick_code = redirect_url.split('/play/')[-1].split('?')[0].strip()
+            player_ua = request.headers.get('User-Agent', 'Mozilla/5.0')
+            client_ip = request.headers.get('X-Real-IP', request.remote_addr)
+            real_115_url = _get_cached_115_url(pick_code, player_ua, client_ip)
+            if real_115_url:
+                # logger.debug("  ✅ 已 302 跳转重定向到 115 直链")
+                return redirect(real_115_url, code=302)
+
+    response_headers = [(name, value) for name, value in resp.headers.items() if name.lower() not in _EXCLUDED_RESP_HEADERS]
+    return Response(resp.content, resp.status_code, response_headers)
+
+def _handle_playback_info(path):
+    """
+    拦截 G: PlaybackInfo 智能劫持 (完美兼容版)。
+    劫持失败时返回 None，交由后续逻辑继续处理。
+    """
+    try:
+        base_url, api_key = _get_real_emby_url_and_key()
+        target_url = f"{base_url}/{path.lstrip('/')}"
+
+        client_name = request.headers.get('X-Emby-Client', '').lower()
+        user_agent = request.headers.get('User-Agent', '').lower()
+
+        forward_headers = _build_forward_headers()
+        forward_params = _build_forward_params(api_key)
+
+        resp = _emby_session.request(method=request.method, url=target_url, headers=forward_headers, params=forward_params, data=request.get_data(), timeout=10)
+
+        if resp.status_code == 200 and 'application/json' in resp.headers.get('Content-Type', ''):
+            data = _json_loads(resp.content)
+            modified = False
+
+            # 【修复核心】先判断是否为浏览器，再决定是否获取115直链
+            is_browser = 'mozilla' in user_agent or 'chrome' in user_agent or 'safari' in user_agent
+
+            # 排除已知的本地播放器 (它们伪装了 UA，但可以通过 Client 或特定关键字识别)
+            native_clients = ['androidtv', 'infuse', 'emby for ios', 'emby for android', 'emby theater', 'senplayer']
+            if any(nc in client_name for nc in native_clients) or 'infuse' in user_agent or 'dalvik' in user_agent:
+                is_browser = False
+
+            # logger.info(f"  🔍 客户端名称: {client_name}, User-Agent: {user_agent[:50]}, 是否浏览器: {is_browser}")
+
+            # 只有非浏览器才获取115直链
+            sources = data.get('MediaSources') or []
+            if not is_browser and sources:
+                # 请求级不变量只取一次；挂载模式的 pick_code 只依赖请求路径，多个 MediaSource 共用一次查库
+                player_ua = request.headers.get('User-Agent', 'Mozilla/5.0')
+                client_ip = request.headers.get('X-Real-IP', request.remote_addr)
+                mount_pick_code = None
+                mount_looked_up = False
+
+                for source in sources:
+                    strm_url = source.get('Path', '')
+                    if not isinstance(strm_url, str):
+                        continue
+
+                    if '/api/p115/play/' in strm_url:
+                        pick_code = strm_url.split('/play/')[-1].split('?')[0].strip()
+                    else:
+                        # 挂载模式：从请求路径提取 item_id 查库
+                        if not mount_looked_up:
+                            mount_pick_code = media_db.get_pickcode_by_emby_id(path.split('/')[2])
+                            mount_looked_up = True
+                        pick_code = mount_pick_code
+
+                    real_115_cdn_url = _get_cached_115_url(pick_code, player_ua, client_ip) if pick_code else None
+
+                    # ★★★ 只有成功获取到直链，才进行劫持注入 ★★★
+                    if real_115_cdn_url:
+                        source['RemoteUrl'] = real_115_cdn_url
+                        source['Path'] = real_115_cdn_url
+                        source['IsRemote'] = True
+                        source.pop('TranscodingUrl', None)
+                        source['Protocol'] = 'Http'
+                        source['SupportsDirectPlay'] = True
+                        source['SupportsDirectStream'] = True
+                        source['SupportsTranscoding'] = False
+                        modified = True
+                        # logger.info(f"  🔗 PlaybackInfo 注入 115 直链: {strm_url[:100]} -> {real_115_cdn_url[:80]}")
+            # else: 浏览器直接跳过，不获取115直链
+
+            if modified:
+                return Response(_json_dumps(data), status=200, mimetype='application/json')
+
+        response_headers = [(name, value) for name, value in resp.headers.items() if name.lower() not in _EXCLUDED_RESP_HEADERS]
+        return Response(resp.content, resp.status_code, response_headers)
+
+    except Exception as e:
+        logger.error(f"  ❌ PlaybackInfo 劫持异常: {e}")
+        return None
+
+def _handle_virtual_item_image(path):
+    """
+    虚拟项目 (缺失占位符 / 虚拟库) 的图片请求，未命中时返回 None。
+    """
+    # --- 拦截 A: 虚拟项目海报图片 ---
+    if path.startswith('emby/Items/') and '/Images/Primary' in path:
+        item_id = path.split('/')[2]
+        if is_missing_item_id(item_id):
+            combined_id = parse_missing_item_id(item_id)
+            real_tmdb_id = combined_id.split('_S_')[0] if '_S_' in combined_id else combined_id
+            meta = queries_db.get_best_metadata_by_tmdb_id(real_tmdb_id)
+            db_status = meta.get('subscription_status', 'WANTED')
+            current_status = db_status if db_status in ['WANTED', 'SUBSCRIBED', 'PENDING_RELEASE', 'PAUSED', 'IGNORED'] else 'WANTED'
+
+            from handler.poster_generator import get_missing_poster
+            img_file_path = get_missing_poster(
+                tmdb_id=real_tmdb_id, 
+                status=current_status,
+                poster_path=meta.get('poster_path')
+            )
+
+            if img_file_path and os.path.exists(img_file_path):
+                # 条件请求：ETag 包含订阅状态和文件修改时间，状态变化或海报重新生成都会让客户端缓存失效，
+                # 其余情况浏览器/客户端带 If-None-Match 回来时直接 304，不再重复下发整张图片
+                mtime = os.path.getmtime(img_file_path)
+                resp = send_file(
+                    img_file_path, mimetype='image/jpeg', conditional=True,
+                    etag=f"{real_tmdb_id}-{current_status}-{int(mtime)}",
+                    last_modified=mtime
+                )
+                resp.headers['Cache-Control'] = 'public, max-age=300, must-revalidate'
+                return resp
+
+    # --- 拦截 E: 虚拟库图片 ---
+    if path.startswith('emby/Items/') and '/Images/' in path:
+        item_id = path.split('/')[2]
+        if is_mimicked_id(item_id):
+            return handle_get_mimicked_library_image(path)
+    return None
+
+def _handle_views(path):
+    """ 拦截 B: 视图列表 (Views)。"""
+    return handle_get_views()
+
+def _handle_latest(path):
+    """ 拦截 C: 最新项目 (Latest)。"""
+    user_id_match = re.search(r'/emby/Users/([^/]+)/', f'/{path}')
+    if user_id_match:
+        return handle_get_latest_items(user_id_match.group(1), request.args)
+    return None
+
+def _handle_mimicked_library_details(path):
+    """ 拦截 D: 虚拟库详情。"""
+    details_match = MIMICKED_ITEM_DETAILS_RE.search(path)
+    if details_match:
+        user_id = details_match.group(1)
+        mimicked_id = details_match.group(2)
+        return handle_get_mimicked_library_details(user_id, mimicked_id)
+    return None
+
+# 拦截分发表：一次正则扫描即可判断路径属于哪类拦截，组名对应 _INTERCEPT_HANDLERS 中的处理函数。
+# 处理函数返回 None 表示不拦截，继续走虚拟库浏览 / 兜底转发逻辑。
+_DISPATCH_RE = re.compile(
+    r'(?P<stream>/videos/.*/(?:stream|original)\.)'
+    r'|(?P<playback_info>PlaybackInfo)'
+    r'|(?P<virtual_image>^emby/Items/-[^/]*/Images/)'
+    r'|(?P<views>^emby/Users/.*/Views$)'
+    r'|(?P<latest>/Items/Latest$)'
+    r'|(?P<mimicked_details>emby/Users/[^/]+/Items/-\d+$)'
+)
+_INTERCEPT_HANDLERS = {
+    'stream': _handle_video_stream,
+    'playback_info': _handle_playback_info,
+    'virtual_image': _handle_virtual_item_image,
+    'views': _handle_views,
+    'latest': _handle_latest,
+    'mimicked_details': _handle_mimicked_library_details,
+}
 
 proxy_app = Flask(__name__)
 
@@ -780,235 +1198,21 @@ def proxy_all(path):
 
     # --- 2. HTTP 代理逻辑 ---
     try:
-        full_path = f'/{path}'
         # ===== 调试日志：打印所有请求路径 =====
-        # logger.info(f"[PROXY] 请求路径: {full_path}")
+        # logger.debug("[PROXY] 请求路径: /%s", path)
         
-        # ====================================================================
-        # ★★★ 拦截 H: 视频流请求 (stream.mkv, stream.mp4, original.mp4 等) ★★★
-        # ====================================================================
-        if '/videos/' in path and ('/stream.' in path or '/original.' in path):
-            # logger.info(f"[STREAM] 进入视频流拦截，path={path}")
-            
-            # 检测浏览器客户端
-            user_agent = request.headers.get('User-Agent', '').lower()
-            client_name = request.headers.get('X-Emby-Client', '').lower()
-            is_browser = 'mozilla' in user_agent or 'chrome' in user_agent or 'safari' in user_agent
-            native_clients = ['androidtv', 'infuse', 'emby for ios', 'emby for android', 'emby theater', 'senplayer']
-            if any(nc in client_name for nc in native_clients) or 'infuse' in user_agent or 'dalvik' in user_agent:
-                is_browser = False
-            
-            # 浏览器直接转发给 Emby 服务端，不做 302 重定向（115 直链存在跨域问题）
-            if is_browser:
-                # logger.info(f"[STREAM] 识别为浏览器，直接转发给 Emby 服务端，不做 302 重定向")
-                base_url, api_key = _get_real_emby_url_and_key()
-                target_url = f"{base_url}/{path.lstrip('/')}"
-                forward_headers = {k: v for k, v in request.headers if k.lower() not in ['host', 'accept-encoding']}
-                forward_headers['Host'] = urlparse(base_url).netloc
-                forward_params = request.args.copy()
-                forward_params['api_key'] = api_key
-                resp = requests.request(method=request.method, url=target_url, headers=forward_headers, params=forward_params, data=request.get_data(), timeout=30.0, stream=True)
-                excluded_resp_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-                response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in excluded_resp_headers]
-                return Response(resp.iter_content(chunk_size=8192), resp.status_code, response_headers)
-            
-            # 客户端才做 302 重定向
-            parts = path.split('/')
-            item_id = parts[2] if len(parts) > 2 else ''
-            play_session_id = request.args.get('PlaySessionId', '')
-            
-            real_115_url = None
-            try:
-                base_url, api_key = _get_real_emby_url_and_key()
-                playback_info_url = f"{base_url}/emby/Items/{item_id}/PlaybackInfo"
-                params = {
-                    'api_key': api_key,
-                    'UserId': request.args.get('UserId', ''),
-                    'MaxStreamingBitrate': 140000000,
-                    'PlaySessionId': play_session_id,
-                }
-                
-                forward_headers = {k: v for k, v in request.headers if k.lower() not in ['host', 'accept-encoding']}
-                forward_headers['Host'] = urlparse(base_url).netloc
-                
-                resp = requests.get(playback_info_url, params=params, headers=forward_headers, timeout=10)
-                
-                if resp.status_code == 200:
-                    data = resp.json()
-                    for source in data.get('MediaSources', []):
-                        strm_url = source.get('Path', '')
-                        if isinstance(strm_url, str):
-                            pick_code = None
-                            if '/api/p115/play/' in strm_url:
-                                pick_code = strm_url.split('/play/')[-1].split('?')[0].strip()
-                            else:
-                                # 挂载模式：通过 item_id 查库获取 PC 码
-                                pick_code = media_db.get_pickcode_by_emby_id(item_id)
-                            
-                            if pick_code:
-                                player_ua = request.headers.get('User-Agent', 'Mozilla/5.0')
-                                client_ip = request.headers.get('X-Real-IP', request.remote_addr)
-                                real_115_url = _get_cached_115_url(pick_code, player_ua, client_ip)
-                                break # <--- 找到直链就跳出循环
-            except Exception as e:
-                logger.error(f"[STREAM] 获取 115 直链失败: {e}")
-            
-            # 如果获取到 115 直链，直接 302 重定向！不要用 Python 中转流！
-            # 这样 Infuse 等播放器会自己去连 115，完美支持拖动进度条，且不消耗服务器带宽。
-            if real_115_url:
-                # logger.info(f"  ✅ 已 302 跳转重定向到 115 直链")
-                return redirect(real_115_url, code=302)
-            
-            # 如果获取失败，回退到原来的转发方式
-            logger.info(f"[STREAM] 回退到转发模式")
-            target_url = f"{base_url}/{path.lstrip('/')}"
-            forward_headers = {k: v for k, v in request.headers if k.lower() not in ['host', 'accept-encoding']}
-            forward_headers['Host'] = urlparse(base_url).netloc
-            forward_params = request.args.copy()
-            forward_params['api_key'] = api_key
-            
-            resp = requests.request(method=request.method, url=target_url, headers=forward_headers, params=forward_params, data=request.get_data(), timeout=10, allow_redirects=False)
-            
-            if resp.status_code in [301, 302]:
-                redirect_url = resp.headers.get('Location', '')
-                if '/api/p115/play/' in redirect_url:
-                    pick_code = redirect_url.split('/play/')[-1].split('?')[0].strip()
-                    player_ua = request.headers.get('User-Agent', 'Mozilla/5.0')
-                    client_ip = request.headers.get('X-Real-IP', request.remote_addr)
-                    real_115_url = _get_cached_115_url(pick_code, player_ua, client_ip)
-                    if real_115_url:
-                        # logger.info(f"  ✅ 已 302 跳转重定向到 115 直链")
-                        return redirect(real_115_url, code=302)
-            
-            excluded_resp_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-            response_headers = [(name, value) for name, value in resp.headers.items() if name.lower() not in excluded_resp_headers]
-            return Response(resp.content, resp.status_code, response_headers)
-        
-        # ====================================================================
-        # ★★★ 终极拦截 G: PlaybackInfo 智能劫持 (完美兼容版) ★★★
-        # ====================================================================
-        if 'PlaybackInfo' in path:
-            try:
-                base_url, api_key = _get_real_emby_url_and_key()
-                target_url = f"{base_url}/{path.lstrip('/')}"
-                
-                client_name = request.headers.get('X-Emby-Client', '').lower()
-                user_agent = request.headers.get('User-Agent', '').lower()
+        # --- 拦截 A~H: 一次正则匹配定位拦截类型，未命中直接进入后续逻辑 ---
+        dispatch_match = _DISPATCH_RE.search(path)
+        if dispatch_match:
+            intercepted = _INTERCEPT_HANDLERS[dispatch_match.lastgroup](path)
+            if intercepted is not None:
+                return intercepted
 
-                forward_headers = {k: v for k, v in request.headers if k.lower() not in ['host', 'accept-encoding']}
-                forward_headers['Host'] = urlparse(base_url).netloc
-                forward_params = request.args.copy()
-                forward_params['api_key'] = api_key
-                
-                resp = requests.request(method=request.method, url=target_url, headers=forward_headers, params=forward_params, data=request.get_data(), timeout=10)
-                
-                if resp.status_code == 200 and 'application/json' in resp.headers.get('Content-Type', ''):
-                    data = resp.json()
-                    modified = False
-                    
-                    # 【修复核心】先判断是否为浏览器，再决定是否获取115直链
-                    is_browser = 'mozilla' in user_agent or 'chrome' in user_agent or 'safari' in user_agent
-                    
-                    # 排除已知的本地播放器 (它们伪装了 UA，但可以通过 Client 或特定关键字识别)
-                    native_clients = ['androidtv', 'infuse', 'emby for ios', 'emby for android', 'emby theater', 'senplayer']
-                    if any(nc in client_name for nc in native_clients) or 'infuse' in user_agent or 'dalvik' in user_agent:
-                        is_browser = False
-                    
-                    # logger.info(f"  🔍 客户端名称: {client_name}, User-Agent: {user_agent[:50]}, 是否浏览器: {is_browser}")
-                    
-                    # 只有非浏览器才获取115直链
-                    if not is_browser:
-                        for source in data.get('MediaSources', []):
-                            strm_url = source.get('Path', '')
-                            if isinstance(strm_url, str):
-                                pick_code = None
-                                real_115_cdn_url = None
-
-                                if '/api/p115/play/' in strm_url:
-                                    pick_code = strm_url.split('/play/')[-1].split('?')[0].strip()
-                                else:
-                                    # 挂载模式：从请求路径提取 item_id 查库
-                                    item_id = path.split('/')[2]
-                                    pick_code = media_db.get_pickcode_by_emby_id(item_id)
-                                    
-                                if pick_code:
-                                    player_ua = request.headers.get('User-Agent', 'Mozilla/5.0')
-                                    client_ip = request.headers.get('X-Real-IP', request.remote_addr)
-                                    real_115_cdn_url = _get_cached_115_url(pick_code, player_ua, client_ip)
-                                
-                                # ★★★ 只有成功获取到直链，才进行劫持注入 ★★★
-                                if real_115_cdn_url:
-                                    source['RemoteUrl'] = real_115_cdn_url
-                                    source['Path'] = real_115_cdn_url
-                                    source['IsRemote'] = True
-                                    source.pop('TranscodingUrl', None)
-                                    source['Protocol'] = 'Http'
-                                    source['SupportsDirectPlay'] = True
-                                    source['SupportsDirectStream'] = True
-                                    source['SupportsTranscoding'] = False
-                                    modified = True
-                    # else: 浏览器直接跳过，不获取115直链
-                            
-                    if modified:
-                        return Response(json.dumps(data), status=200, mimetype='application/json')
-                        
-                excluded_resp_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-                response_headers = [(name, value) for name, value in resp.headers.items() if name.lower() not in excluded_resp_headers]
-                return Response(resp.content, resp.status_code, response_headers)
-                
-            except Exception as e:
-                logger.error(f"  ❌ PlaybackInfo 劫持异常: {e}")
-
-        # --- 拦截 A: 虚拟项目海报图片 ---
-        if path.startswith('emby/Items/') and '/Images/Primary' in path:
-            item_id = path.split('/')[2]
-            if is_missing_item_id(item_id):
-                combined_id = parse_missing_item_id(item_id)
-                real_tmdb_id = combined_id.split('_S_')[0] if '_S_' in combined_id else combined_id
-                meta = queries_db.get_best_metadata_by_tmdb_id(real_tmdb_id)
-                db_status = meta.get('subscription_status', 'WANTED')
-                current_status = db_status if db_status in ['WANTED', 'SUBSCRIBED', 'PENDING_RELEASE', 'PAUSED', 'IGNORED'] else 'WANTED'
-                
-                from handler.poster_generator import get_missing_poster
-                img_file_path = get_missing_poster(
-                    tmdb_id=real_tmdb_id, 
-                    status=current_status,
-                    poster_path=meta.get('poster_path')
-                )
-                
-                if img_file_path and os.path.exists(img_file_path):
-                    resp = send_file(img_file_path, mimetype='image/jpeg')
-                    resp.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-                    return resp
-
-        # --- 拦截 B: 视图列表 (Views) ---
-        if path.endswith('/Views') and path.startswith('emby/Users/'):
-            return handle_get_views()
-
-        # --- 拦截 C: 最新项目 (Latest) ---
-        if path.endswith('/Items/Latest'):
-            user_id_match = re.search(r'/emby/Users/([^/]+)/', full_path)
-            if user_id_match:
-                return handle_get_latest_items(user_id_match.group(1), request.args)
-
-        # --- 拦截 D: 虚拟库详情 ---
-        details_match = MIMICKED_ITEM_DETAILS_RE.search(full_path)
-        if details_match:
-            user_id = details_match.group(1)
-            mimicked_id = details_match.group(2)
-            return handle_get_mimicked_library_details(user_id, mimicked_id)
-
-        # --- 拦截 E: 虚拟库图片 ---
-        if path.startswith('emby/Items/') and '/Images/' in path:
-            item_id = path.split('/')[2]
-            if is_mimicked_id(item_id):
-                return handle_get_mimicked_library_image(path)
-        
         # --- 拦截 F: 虚拟库内容浏览 (Items) ---
         parent_id = request.args.get("ParentId")
         if parent_id and is_mimicked_id(parent_id):
             # 处理元数据请求
-            if any(path.endswith(endpoint) for endpoint in UNSUPPORTED_METADATA_ENDPOINTS + ['/Items/Prefixes', '/Genres', '/Studios', '/Tags', '/OfficialRatings', '/Years']):
+            if _METADATA_ENDPOINT_RE.search(path):
                 return handle_mimicked_library_metadata_endpoint(path, parent_id, request.args)
             
             # 处理内容列表请求
@@ -1021,13 +1225,11 @@ def proxy_all(path):
         base_url, api_key = _get_real_emby_url_and_key()
         target_url = f"{base_url}/{path.lstrip('/')}"
         
-        forward_headers = {k: v for k, v in request.headers if k.lower() not in ['host', 'accept-encoding']}
-        forward_headers['Host'] = urlparse(base_url).netloc
+        forward_headers = _build_forward_headers(identity_encoding=True)
         
-        forward_params = request.args.copy()
-        forward_params['api_key'] = api_key
+        forward_params = _build_forward_params(api_key)
         
-        resp = requests.request(
+        resp = _emby_session.request(
             method=request.method,
             url=target_url,
             headers=forward_headers,
@@ -1037,10 +1239,9 @@ def proxy_all(path):
             timeout=30.0
         )
         
-        excluded_resp_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-        response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in excluded_resp_headers]
+        response_headers = [(name, value) for name, value in resp.raw.headers.items() if name.lower() not in _EXCLUDED_RESP_HEADERS]
         
-        return Response(resp.iter_content(chunk_size=8192), resp.status_code, response_headers)
+        return Response(_iter_upstream_body(resp), resp.status_code, response_headers)
         
     except Exception as e:
         logger.error(f"[PROXY] HTTP 代理时发生未知错误: {e}", exc_info=True)
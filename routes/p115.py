@@ -1,20 +1,36 @@
 # routes/p115.py
+import atexit
+import base64
+import hashlib
 import logging
 from flask import redirect
 import threading
-from datetime import datetime, timedelta
 import json
 import os
 import re
 import time
 import requests
+from urllib.parse import urlparse, unquote, unquote_plus
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http.cookiejar import DefaultCookiePolicy
+from gevent import spawn, sleep, joinall
+from gevent.event import AsyncResult
 from flask import Blueprint, jsonify, request, redirect
 from extensions import admin_required
 from database import settings_db
-from handler.p115_service import P115Service, get_config
+from handler.p115_service import P115Service, get_config, get_115_tokens, save_115_tokens
 from tasks.helpers import convert_strm_content_to_etk
 import constants
-from functools import lru_cache, wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from cachetools import TTLCache
+
+# orjson 为可选依赖：解析 JSON 明显快于标准库 json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # 115扫码登录相关变量 (OAuth 2.0 + PKCE 模式)
 _qrcode_data = {
@@ -24,19 +40,53 @@ _qrcode_data = {
     "sign": None,         # 签名
     "code_verifier": None,# PKCE verifier
     "access_token": None,  # 最终获取的 access_token
-    "refresh_token": None  # 刷新token
+    "refresh_token": None, # 刷新token
+    "status": "idle",      # 后台轮询得到的状态: idle / waiting / scanned / success / expired / error
+    "message": "请先获取二维码",
+    "progress": 0,         # 单调递增的进度 (0 等待扫码 -> 50 已扫码 -> 100 完成)
+    "last_error": None
 }
+# 写时复制：写入方构造新字典后整体替换 _qrcode_data (引用赋值是原子的)，读取方取一次引用即可无锁读取一致快照；
+# 该锁只用于串行化写入方的"读-改-写"，读取方不需要持有
+_qrcode_lock = threading.Lock()
+# 后台轮询参数：两次查询的间隔 / 单个二维码最长轮询时间
+QRCODE_POLL_INTERVAL = 2
+QRCODE_POLL_TTL = 300
+# 轮询出错时的最长退避间隔 (秒)
+QRCODE_POLL_MAX_BACKOFF = 16
 p115_bp = Blueprint('115_bp', __name__, url_prefix='/api/p115')
 logger = logging.getLogger(__name__)
 
+# 115 OAuth / 扫码 / 凭证探测共用的连接池，复用到 passportapi、qrcodeapi、proapi、webapi 的 TLS 连接
+# (读超时不重试：扫码状态接口本身就是长轮询)
+_http = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=2, read=0, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+)
+_http.mount('https://', _http_adapter)
+_http.mount('http://', _http_adapter)
+# 不让共享会话积累 Cookie：各次登录/探测都显式携带自己的凭证，互不串号
+_http.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+# httpx (需 h2) 为可选依赖：可用时 PKCE 扫码授权的三个接口走 HTTP/2 长连接，否则沿用上面的 requests 会话
+_OAUTH_TIMEOUT_ERRORS = (requests.exceptions.Timeout,)
+try:
+    import httpx
+    _oauth_http = httpx.Client(
+        http2=True,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=16)
+    )
+    _OAUTH_TIMEOUT_ERRORS = (requests.exceptions.Timeout, httpx.TimeoutException)
+    atexit.register(_oauth_http.close)
+except ImportError:
+    _oauth_http = _http
+
 # --- 115扫码登录相关API (OAuth 2.0 + PKCE 模式) ---
 
 def _generate_pkce_pair():
     """生成 PKCE 的 verifier 和 challenge"""
-    import base64
-    import os
-    import hashlib
-    
     # 1. 生成 43~128 位的随机字符串 (code_verifier)
     verifier = base64.urlsafe_b64encode(os.urandom(40)).decode('utf-8').rstrip('=')
     
@@ -59,20 +109,26 @@ def _generate_qrcode():
             "code_challenge": challenge,
             "code_challenge_method": "sha256"
         }
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        
-        resp = requests.post(url, data=payload, headers=headers, timeout=10)
+        resp = _oauth_http.post(url, data=payload, timeout=10)
         result = resp.json()
         
         if result.get('state'):
             qr_data = result.get('data', {})
-            _qrcode_data['qrcode'] = qr_data.get('qrcode')
-            _qrcode_data['uid'] = qr_data.get('uid')
-            _qrcode_data['time'] = qr_data.get('time')
-            _qrcode_data['sign'] = qr_data.get('sign')
-            _qrcode_data['code_verifier'] = verifier
-            _qrcode_data['access_token'] = None
-            _qrcode_data['refresh_token'] = None
+            _update_qrcode_data(
+                qrcode=qr_data.get('qrcode'),
+                uid=qr_data.get('uid'),
+                time=qr_data.get('time'),
+                sign=qr_data.get('sign'),
+                code_verifier=verifier,
+                access_token=None,
+                refresh_token=None,
+                status='waiting',
+                message='等待扫码...',
+                progress=0,
+                last_error=None,
+            )
+            # 由后台协程驱动 115 的长轮询，前端查询状态时只读内存，不再占用请求线程
+            spawn(_qrcode_poll_loop, qr_data.get('uid'))
             return qr_data
         else:
             logger.error(f"获取二维码失败: {result.get('message')}")
@@ -81,21 +137,45 @@ def _generate_qrcode():
         logger.error(f"生成二维码失败: {e}")
         return None
 
-def _check_qrcode_status():
-    """检查二维码扫码状态 (OAuth 2.0 + PKCE 新版API)"""
-    if not _qrcode_data.get('uid') or not _qrcode_data.get('time'):
+def _update_qrcode_data(expected_uid=None, **changes):
+    """
+    以写时复制方式更新 _qrcode_data：基于当前字典构造新字典，再整体替换模块变量。
+    传入 expected_uid 时仅当当前二维码仍是该 uid 才写入 (防止旧轮询覆盖新二维码)，且进度只增不减；
+    返回是否写入。
+    """
+    global _qrcode_data
+    with _qrcode_lock:
+        current = _qrcode_data
+        new_data = {**current, **changes}
+        if expected_uid is not None:
+            if current.get('uid') != expected_uid:
+                return False
+            if 'progress' in changes:
+                # 进度只增不减，避免前端进度条回退
+                new_data['progress'] = max(current.get('progress') or 0, changes['progress'])
+        _qrcode_data = new_data
+        return True
+
+def _check_qrcode_status_once():
+    """查询一次二维码扫码状态 (OAuth 2.0 + PKCE 新版API)，由后台轮询协程调用"""
+    snap = _qrcode_data
+    uid = snap.get('uid')
+    time_val = snap.get('time')
+    sign = snap.get('sign')
+    code_verifier = snap.get('code_verifier')
+    if not uid or not time_val:
         return {"status": "waiting", "message": "请先获取二维码"}
     
     try:
         # 1. 先轮询二维码状态
         url = "https://qrcodeapi.115.com/get/status/"
         params = {
-            "uid": _qrcode_data.get('uid'),
-            "time": _qrcode_data.get('time'),
-            "sign": _qrcode_data.get('sign')
+            "uid": uid,
+            "time": time_val,
+            "sign": sign
         }
         
-        resp = requests.get(url, params=params, timeout=30)
+        resp = _oauth_http.get(url, params=params, timeout=30)
         result = resp.json()
         
         state = result.get('state')
@@ -111,18 +191,16 @@ def _check_qrcode_status():
             
             if status == 1:
                 # 已扫码，等待确认
-                return {"status": "waiting", "message": "已扫码，等待手机端确认..."}
+                return {"status": "scanned", "message": "已扫码，等待手机端确认..."}
             elif status == 2:
                 # 已确认，现在需要换取 token
                 # 2. 用 device code 换取 access_token
                 token_url = "https://passportapi.115.com/open/deviceCodeToToken"
                 token_payload = {
-                    "uid": _qrcode_data.get('uid'),
-                    "code_verifier": _qrcode_data.get('code_verifier')
+                    "uid": uid,
+                    "code_verifier": code_verifier
                 }
-                token_headers = {"Content-Type": "application/x-www-form-urlencoded"}
-                
-                token_resp = requests.post(token_url, data=token_payload, headers=token_headers, timeout=10)
+                token_resp = _oauth_http.post(token_url, data=token_payload, timeout=10)
                 token_result = token_resp.json()
                 
                 if token_result.get('state'):
@@ -131,22 +209,13 @@ def _check_qrcode_status():
                     refresh_token = token_data.get('refresh_token')
                     
                     if access_token:
-                        _qrcode_data['access_token'] = access_token
-                        _qrcode_data['refresh_token'] = refresh_token
-                        
-                        # 3. 用 access_token 获取用户信息来验证
-                        user_info_url = "https://proapi.115.com/open/user/info"
-                        user_headers = {"Authorization": f"Bearer {access_token}"}
-                        user_resp = requests.get(user_info_url, headers=user_headers, timeout=10)
-                        user_result = user_resp.json()
-                        
-                        # 构造 cookies 格式 (UID=...; CID=...; SEID=...)
-                        cookies = f"UID={_qrcode_data.get('uid')}; CID={_qrcode_data.get('uid')}; SEID={access_token}"
+                        _update_qrcode_data(expected_uid=uid, access_token=access_token, refresh_token=refresh_token)
                         
+                        # 3. 用户信息验证与 Token 落库互不依赖，交给轮询协程并发执行
                         return {
                             "status": "success", 
                             "message": "登录成功",
-                            "user_info": user_result.get('data', {}),
+                            "access_token": access_token,
                             "refresh_token": refresh_token
                         }
                 else:
@@ -156,12 +225,83 @@ def _check_qrcode_status():
         
         return {"status": "waiting", "message": "等待扫码..."}
             
-    except requests.exceptions.Timeout:
+    except _OAUTH_TIMEOUT_ERRORS:
         return {"status": "waiting", "message": "轮询超时，继续等待..."}
     except Exception as e:
         logger.error(f"检查二维码状态失败: {e}")
         return {"status": "error", "message": str(e)}
     
+_QRCODE_PROGRESS = {"waiting": 0, "scanned": 50, "success": 100, "expired": 100}
+
+def _fetch_115_user_info(access_token):
+    """用 access_token 获取 115 用户信息 (用于验证新 Token)，失败返回 None"""
+    try:
+        user_info_url = "https://proapi.115.com/open/user/info"
+        user_headers = {"Authorization": f"Bearer {access_token}"}
+        return _oauth_http.get(user_info_url, headers=user_headers, timeout=10).json().get('data', {})
+    except Exception as e:
+        logger.warning(f"  ⚠️ [115] 获取用户信息失败: {e}")
+        return None
+
+def _save_qrcode_tokens(access_token, refresh_token):
+    """扫码成功后保存 Token"""
+    try:
+        # ★ 直接调用小金库存钱函数
+        if access_token and refresh_token:
+            save_115_tokens(access_token, refresh_token)
+            _invalidate_cached_client()
+            logger.info(f"  ✅ [115] 扫码成功！Token 已保存。")
+    except Exception as e:
+        logger.error(f"  ❌ 保存 Token 失败: {e}")
+
+def _qrcode_poll_loop(uid):
+    """
+    后台轮询某个二维码的状态，写入 _qrcode_data 供前端查询。
+    二维码被新的替换、成功、过期或超过 QRCODE_POLL_TTL 时退出；
+    出错 (网络抖动、换取 Token 失败等) 只记录 last_error 并退避重试，不终止轮询。
+    """
+    deadline = time.monotonic() + QRCODE_POLL_TTL
+    consecutive_errors = 0
+    while True:
+        if _qrcode_data.get('uid') != uid:
+            return # 已生成新二维码，由新的轮询协程接管
+
+        if time.monotonic() > deadline:
+            result = {"status": "expired", "message": "二维码已过期，请重新获取"}
+        else:
+            result = _check_qrcode_status_once()
+
+        status = result.get('status')
+        if status == 'success':
+            # 用户信息验证 (proapi) 与 Token 落库 (数据库) 重叠进行：HTTP 请求必须先启动，
+            # 它在 socket 上让出后落库才开始；psycopg2 未协程化，落库期间会阻塞 hub，先落库则两者只能串行
+            access_token = result.get('access_token')
+            info_g = spawn(_fetch_115_user_info, access_token)
+            save_g = spawn(_save_qrcode_tokens, access_token, result.get('refresh_token'))
+            joinall([save_g, info_g])
+            user_info = info_g.value or {}
+            if user_info.get('user_name'):
+                logger.info(f"  ✅ [115] 已登录账号: {user_info.get('user_name')}")
+
+        changes = {"status": status, "message": result.get('message', '')}
+        if status == 'error':
+            # 出错不推进进度：后续轮询成功时状态会被覆盖
+            changes["last_error"] = result.get('message')
+        else:
+            changes["progress"] = _QRCODE_PROGRESS.get(status, 0)
+        if not _update_qrcode_data(expected_uid=uid, **changes):
+            return
+
+        if status in ('success', 'expired'):
+            return
+        if status == 'error':
+            consecutive_errors += 1
+            logger.warning(f"  ⚠️ [115] 扫码状态轮询出错，稍后重试: {result.get('message')}")
+            sleep(min(QRCODE_POLL_INTERVAL * 2 ** consecutive_errors, QRCODE_POLL_MAX_BACKOFF))
+        else:
+            consecutive_errors = 0
+            sleep(QRCODE_POLL_INTERVAL)
+
 # --- ★★★ 新增：经典扫码获取 Cookie 流程 (支持多端) ★★★ ---
 _cookie_qrcode_data = {
     "uid": None,
@@ -176,7 +316,7 @@ def get_cookie_qrcode():
     app_type = request.args.get('app', 'alipaymini') # 默认支付宝小程序
     try:
         url = f"https://qrcodeapi.115.com/api/1.0/web/1.0/token/?app={app_type}"
-        resp = requests.get(url, timeout=10).json()
+        resp = _http.get(url, timeout=10).json()
         
         if resp.get('state') == 1:
             data = resp.get('data', {})
@@ -207,7 +347,7 @@ def check_cookie_qrcode_status():
     try:
         # 1. 轮询状态
         url = f"https://qrcodeapi.115.com/get/status/?uid={uid}&time={time_val}&sign={sign}"
-        resp = requests.get(url, timeout=10).json()
+        resp = _http.get(url, timeout=10).json()
         
         state = resp.get('state')
         if state == 0:
@@ -223,7 +363,7 @@ def check_cookie_qrcode_status():
                 payload = {"account": uid, "app": app_type}
                 
                 # ★ 关键：必须捕获响应头里的 Set-Cookie
-                login_resp = requests.post(login_url, data=payload, timeout=10)
+                login_resp = _http.post(login_url, data=payload, timeout=10)
                 login_data = login_resp.json()
                 
                 if login_data.get('state') == 1:
@@ -232,11 +372,11 @@ def check_cookie_qrcode_status():
                     cookie_str = "; ".join([f"{k}={v}" for k, v in cookies_dict.items()])
                     
                     # ★ 保存到独立数据库
-                    from handler.p115_service import save_115_tokens
                     save_115_tokens(None, None, cookie_str)
                     
                     # 重置客户端缓存
                     P115Service.reset_cookie_client()
+                    _invalidate_cached_client()
                     
                     return jsonify({"success": True, "status": "success", "message": "Cookie 获取成功！"})
                 else:
@@ -252,9 +392,9 @@ def save_manual_cookie():
     """手动保存 Cookie 到独立数据库"""
     cookie_str = request.json.get('cookie', '').strip()
     try:
-        from handler.p115_service import save_115_tokens
         save_115_tokens(None, None, cookie_str)
         P115Service.reset_cookie_client()
+        _invalidate_cached_client()
         return jsonify({"success": True, "message": "Cookie 已保存"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -277,51 +417,70 @@ def get_qrcode():
 @p115_bp.route('/qrcode/status', methods=['GET'])
 @admin_required
 def check_qrcode_status():
-    """检查扫码登录状态"""
-    status = _check_qrcode_status()
+    """检查扫码登录状态 (只读取后台轮询写入的内存状态，不发起任何外部请求)"""
+    snap = _qrcode_data
+    status = snap.get('status')
+    message = snap.get('message')
+    progress = snap.get('progress')
     
-    if status.get('status') == 'success':
-        access_token = _qrcode_data.get('access_token')
-        refresh_token = _qrcode_data.get('refresh_token')
-        
-        if access_token and refresh_token:
-            try:
-                # ★ 直接调用小金库存钱函数
-                from handler.p115_service import save_115_tokens
-                save_115_tokens(access_token, refresh_token)
-                logger.info(f"  ✅ [115] 扫码成功！Token 已保存。")
-                    
-            except Exception as e:
-                logger.error(f"  ❌ 保存 Token 失败: {e}")
-        
+    if status == 'success':
         return jsonify({
             "success": True,
             "status": "success",
             "message": "授权成功！",
+            "progress": progress,
         })
-        
-    elif status.get('status') == 'expired':
-        return jsonify({"success": False, "status": "expired", "message": "二维码已过期，请重新获取"})
-    elif status.get('status') == 'waiting':
-        return jsonify({"success": True, "status": "waiting", "message": "等待扫码..."})
+    elif status == 'expired':
+        return jsonify({"success": False, "status": "expired", "message": "二维码已过期，请重新获取", "progress": progress})
+    elif status in ('waiting', 'scanned', 'idle'):
+        return jsonify({"success": True, "status": "waiting", "message": message or "等待扫码...", "progress": progress})
     else:
-        return jsonify({"success": False, "status": "error", "message": status.get('message', '检查状态失败')}), 500
+        return jsonify({"success": False, "status": "error", "message": message or '检查状态失败', "progress": progress}), 500
+
+# --- 115 客户端复用 ---
+# P115Service.get_client() 每次都会读库取凭证并重新组装客户端；热路径上短时间内复用同一个实例。
+# 凭证在本模块内变更时主动失效；服务层重建/重置了底层客户端时按对象身份识别并重新获取。
+CLIENT_CACHE_TTL = 60
+_client_cache = {"ts": 0.0, "client": None}
+_client_cache_lock = threading.Lock()
+
+def _cached_client():
+    """获取 (短时复用的) 115 客户端，未配置凭证时返回 None"""
+    with _client_cache_lock:
+        client = _client_cache["client"]
+        if (client is not None
+                and time.monotonic() - _client_cache["ts"] < CLIENT_CACHE_TTL
+                and getattr(client, '_openapi', None) is P115Service._openapi_client
+                and getattr(client, '_cookie', None) is P115Service._cookie_client):
+            return client
+
+    client = P115Service.get_client()
+    with _client_cache_lock:
+        _client_cache["client"] = client
+        _client_cache["ts"] = time.monotonic()
+    return client
+
+def _invalidate_cached_client():
+    """凭证保存/重置后调用，下次请求重新获取客户端"""
+    with _client_cache_lock:
+        _client_cache["client"] = None
+        _client_cache["ts"] = 0.0
 
 # --- 简单的令牌桶/计数器限流器 ---
 class RateLimiter:
     def __init__(self, max_requests=3, period=2):
         self.max_requests = max_requests  # 周期内最大请求数
         self.period = period              # 周期（秒）
+        self.rate = max_requests / period # 每秒补充的令牌数
         self.tokens = max_requests
-        self.last_sync = datetime.now()
+        self.last_sync = time.monotonic()  # 单调时钟：不受系统时间调整影响，也无需构造 datetime 对象
         self.lock = threading.Lock()
 
     def consume(self):
         with self.lock:
-            now = datetime.now()
+            now = time.monotonic()
             # 补充令牌
-            elapsed = (now - self.last_sync).total_seconds()
-            self.tokens = min(self.max_requests, self.tokens + elapsed * (self.max_requests / self.period))
+            self.tokens = min(self.max_requests, self.tokens + (now - self.last_sync) * self.rate)
             self.last_sync = now
 
             if self.tokens >= 1:
@@ -334,7 +493,6 @@ class RateLimiter:
 def get_115_status():
     """检查 115 凭证状态 (分别检查 Token 和 Cookie)"""
     try:
-        from handler.p115_service import P115Service, get_115_tokens
         token, _, cookie = get_115_tokens() # ★ 从数据库读
         token = (token or "").strip() 
         cookie = (cookie or "").strip()
@@ -366,7 +524,7 @@ def get_115_status():
                                     "Cookie": cookie
                                 }
                                 # 用极轻量的官方目录接口探测 Cookie 存活状态
-                                resp = requests.get("https://webapi.115.com/files?cid=0&limit=1", headers=headers, timeout=5).json()
+                                resp = _http.get("https://webapi.115.com/files?cid=0&limit=1", headers=headers, timeout=5).json()
                                 if resp.get('state'):
                                     result["msg"] = "Token + Cookie 均有效"
                                 else:
@@ -389,7 +547,7 @@ def get_115_status():
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
                     "Cookie": cookie
                 }
-                resp = requests.get("https://webapi.115.com/files?cid=0&limit=1", headers=headers, timeout=10).json()
+                resp = _http.get("https://webapi.115.com/files?cid=0&limit=1", headers=headers, timeout=10).json()
                 if resp.get('state'):
                     result["valid"] = True
                     result["msg"] = "仅配置 Cookie (播放专用)"
@@ -412,7 +570,7 @@ def get_115_status():
 @admin_required
 def list_115_directories():
     """获取 115 目录列表"""
-    client = P115Service.get_client()
+    client = _cached_client()
     if not client:
         return jsonify({"status": "error", "message": "无法初始化 115 客户端，请检查凭证"}), 500
 
@@ -471,7 +629,7 @@ def create_115_directory():
     if not name:
         return jsonify({"status": "error", "message": "目录名称不能为空"}), 400
         
-    client = P115Service.get_client()
+    client = _cached_client()
     if not client:
         return jsonify({"status": "error", "message": "无法初始化 115 客户端"}), 500
         
@@ -484,6 +642,62 @@ def create_115_directory():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# 分类规则路径解析的并发数：上游 QPS 已由 StrictSplitClient 的统一流控 (P115Service._lock + 请求间隔) 约束，
+# 这里只让多条规则的网络往返互相重叠
+RULE_PATH_WORKERS = 4
+
+def _resolve_rule_path(rule, client, media_root_cid):
+    """查询单条规则对应目录的层级链路，计算相对媒体库根目录的 category_path 并写回 rule"""
+    cid = rule.get('cid')
+    if not cid or str(cid) == '0':
+        return
+    try:
+        payload = {'cid': cid, 'limit': 1, 'record_open_time': 0, 'count_folders': 0}
+        dir_info = {}
+        if hasattr(client, 'fs_files_app'):
+            dir_info = client.fs_files(payload)
+            
+        path_nodes = dir_info.get('path', [])
+        
+        start_idx = 0
+        found_root = False
+        
+        # 在链路中寻找“媒体库根目录”
+        if media_root_cid == '0':
+            # ★ 修复 0 层级 Bug：115 的根目录永远在 index 0，所以从 1 开始切片是绝对正确的。
+            # 但如果分类目录本身就是根目录，这里需要特殊处理
+            if str(cid) == '0':
+                start_idx = 0
+            else:
+                start_idx = 1 
+            found_root = True
+        else:
+            for i, node in enumerate(path_nodes):
+                if str(node.get('cid')) == media_root_cid:
+                    start_idx = i + 1 # 从根目录的下一级开始取
+                    found_root = True
+                    break
+        
+        if found_root and start_idx < len(path_nodes):
+            # ★ 修复：兼容所有可能的键名，并防止 str(None) 变成 "None"
+            rel_segments = []
+            for n in path_nodes[start_idx:]:
+                node_name = n.get('file_name') or n.get('fn') or n.get('name') or n.get('n')
+                if node_name:
+                    rel_segments.append(str(node_name).strip())
+            
+            rule['category_path'] = "/".join(rel_segments) if rel_segments else rule.get('dir_name', '未识别')
+        else:
+            # 兜底：如果层级异常或没找到根目录，用规则里配的名称
+            rule['category_path'] = rule.get('dir_name', '未识别')
+            
+        logger.info(f"  📂 已为规则 '{rule.get('name')}' 自动计算并保存路径: {rule.get('category_path')}")
+        
+    except Exception as e:
+        logger.warning(f"  ⚠️ 获取规则 '{rule.get('name')}' 路径失败: {e}")
+        if not rule.get('category_path'):
+            rule['category_path'] = rule.get('dir_name', '')
+
 @p115_bp.route('/sorting_rules', methods=['GET', 'POST'])
 @admin_required
 def handle_sorting_rules():
@@ -496,7 +710,7 @@ def handle_sorting_rules():
                 rules = raw_rules
             elif isinstance(raw_rules, str):
                 try:
-                    parsed = json.loads(raw_rules)
+                    parsed = _json_loads(raw_rules)
                     if isinstance(parsed, list):
                         rules = parsed
                 except Exception as e:
@@ -515,60 +729,22 @@ def handle_sorting_rules():
             rules = []
         
         # ★★★ 修复：精准计算基于 p115_media_root_cid 的相对层级路径 ★★★
-        client = P115Service.get_client()
+        client = _cached_client()
         if client:
             config = get_config()
             # 获取用户配置的媒体库根目录 CID
             media_root_cid = str(config.get(constants.CONFIG_OPTION_115_MEDIA_ROOT_CID, '0'))
             
-            for rule in rules:
-                cid = rule.get('cid')
-                if cid and str(cid) != '0':
-                    try:
-                        payload = {'cid': cid, 'limit': 1, 'record_open_time': 0, 'count_folders': 0}
-                        if hasattr(client, 'fs_files_app'):
-                            dir_info = client.fs_files(payload)
-                            
-                        path_nodes = dir_info.get('path', [])
-                        
-                        start_idx = 0
-                        found_root = False
-                        
-                        # 在链路中寻找“媒体库根目录”
-                        if media_root_cid == '0':
-                            # ★ 修复 0 层级 Bug：115 的根目录永远在 index 0，所以从 1 开始切片是绝对正确的。
-                            # 但如果分类目录本身就是根目录，这里需要特殊处理
-                            if str(cid) == '0':
-                                start_idx = 0
-                            else:
-                                start_idx = 1 
-                            found_root = True
-                        else:
-                            for i, node in enumerate(path_nodes):
-                                if str(node.get('cid')) == media_root_cid:
-                                    start_idx = i + 1 # 从根目录的下一级开始取
-                                    found_root = True
-                                    break
-                        
-                        if found_root and start_idx < len(path_nodes):
-                            # ★ 修复：兼容所有可能的键名，并防止 str(None) 变成 "None"
-                            rel_segments = []
-                            for n in path_nodes[start_idx:]:
-                                node_name = n.get('file_name') or n.get('fn') or n.get('name') or n.get('n')
-                                if node_name:
-                                    rel_segments.append(str(node_name).strip())
-                            
-                            rule['category_path'] = "/".join(rel_segments) if rel_segments else rule.get('dir_name', '未识别')
-                        else:
-                            # 兜底：如果层级异常或没找到根目录，用规则里配的名称
-                            rule['category_path'] = rule.get('dir_name', '未识别')
-                            
-                        logger.info(f"  📂 已为规则 '{rule.get('name')}' 自动计算并保存路径: {rule.get('category_path')}")
-                        
-                    except Exception as e:
-                        logger.warning(f"  ⚠️ 获取规则 '{rule.get('name')}' 路径失败: {e}")
-                        if not rule.get('category_path'):
-                            rule['category_path'] = rule.get('dir_name', '')
+            # 各规则的目录查询互不依赖，并发执行；结果直接写回各自的 rule 字典，顺序不变
+            pending = [r for r in rules if r.get('cid') and str(r.get('cid')) != '0']
+            if len(pending) <= 1:
+                for rule in pending:
+                    _resolve_rule_path(rule, client, media_root_cid)
+            else:
+                with ThreadPoolExecutor(max_workers=min(RULE_PATH_WORKERS, len(pending))) as executor:
+                    futures = [executor.submit(_resolve_rule_path, rule, client, media_root_cid) for rule in pending]
+                    for future in as_completed(futures):
+                        future.result()
         
         settings_db.save_setting(constants.DB_KEY_115_SORTING_RULES, rules)
         return jsonify({"status": "success", "message": "115 分类规则已保存"})
@@ -576,8 +752,23 @@ def handle_sorting_rules():
 
 # ★ 收紧限流器，专门对付 Emby 的并发探测 (1秒1次即可，保护 115 账号)
 api_limiter = RateLimiter(max_requests=1, period=1)
-fetch_lock = threading.Lock()
-_url_cache = {}
+# 直链缓存：有界 TTL 缓存，过期条目与冷门 pick_code 自动淘汰，不会随 UA 组合无限增长
+URL_CACHE_TTL = 7200
+URL_NEGATIVE_CACHE_TTL = 10
+_url_cache = TTLCache(maxsize=20000, ttl=URL_CACHE_TTL)
+# 失败/无客户端的短期负缓存，防止同一 pick_code 在 10 秒内反复打 115
+_url_negative_cache = TTLCache(maxsize=4096, ttl=URL_NEGATIVE_CACHE_TTL)
+_url_cache_lock = threading.RLock()
+# ★ 请求合并 (singleflight)：同一 (pick_code, UA) 冷缓存时只放一个请求去 115，其余等待同一结果
+_url_inflight = {}
+_url_inflight_lock = threading.Lock()
+URL_INFLIGHT_WAIT_TIMEOUT = 30
+# ★ 提前续期 (stale-while-revalidate)：命中时剩余有效期不足该值，先返回旧直链，再后台向 115 换新
+URL_CACHE_REFRESH_AHEAD = 600
+# 续期请求同样要排队经过 P115Service 的全局直链锁，为免挤占真实播放的冷启动，同时最多只放行这么多个
+URL_REFRESH_MAX_INFLIGHT = 1
+_url_refreshing = set()
+_url_refresh_lock = threading.Lock()
 
 def _get_cached_115_url(pick_code, user_agent, client_ip=None):
     """
@@ -585,16 +776,62 @@ def _get_cached_115_url(pick_code, user_agent, client_ip=None):
     """
     # ★ 恢复 UA 隔离：确保刮削器和播放器获取各自专属的直链，防止 403！
     cache_key = (pick_code, user_agent) 
-    now = time.time()
-    
-    # 1. 先检查缓存及是否过期 (无锁极速读取)
-    if cache_key in _url_cache:
-        cached_data = _url_cache[cache_key]
-        if now < cached_data["expire_at"]:
-            return cached_data["url"]
-        else:
-            del _url_cache[cache_key]
     
+    # 1. 先检查缓存 (过期由 TTLCache 自行处理)：命中路径不取任何锁，只有未命中才进入下面的合并/加锁逻辑
+    entry = _url_cache.get(cache_key)
+    if entry is not None:
+        if entry["expire_at"] - time.monotonic() < URL_CACHE_REFRESH_AHEAD:
+            _schedule_115_url_refresh(cache_key, pick_code, user_agent)
+        return entry["url"]
+    if cache_key in _url_negative_cache:
+        return None
+
+    # 2. 缓存未命中：同 key 已有请求在途时直接等待其结果，避免多个播放器同时打 115 (惊群)
+    with _url_inflight_lock:
+        pending = _url_inflight.get(cache_key)
+        is_leader = pending is None
+        if is_leader:
+            pending = AsyncResult()
+            _url_inflight[cache_key] = pending
+
+    if not is_leader:
+        return pending.wait(URL_INFLIGHT_WAIT_TIMEOUT)
+
+    direct_url = None
+    try:
+        direct_url = _resolve_115_url(cache_key, pick_code, user_agent)
+        return direct_url
+    finally:
+        with _url_inflight_lock:
+            _url_inflight.pop(cache_key, None)
+        pending.set(direct_url)
+
+def _schedule_115_url_refresh(cache_key, pick_code, user_agent):
+    """
+    为即将过期的缓存条目安排一次后台续期：全局最多 URL_REFRESH_MAX_INFLIGHT 个续期在途，
+    直链锁正被占用 (有请求在解析) 时本次不续期，刚失败过的 key 等负缓存过期再试。
+    跳过的条目在下次命中时会再次尝试，到期前总有空闲时机。
+    """
+    if cache_key in _url_negative_cache or P115Service._downurl_lock.locked():
+        return
+    with _url_refresh_lock:
+        if cache_key in _url_refreshing or len(_url_refreshing) >= URL_REFRESH_MAX_INFLIGHT:
+            return
+        _url_refreshing.add(cache_key)
+    spawn(_refresh_115_url, cache_key, pick_code, user_agent)
+
+def _refresh_115_url(cache_key, pick_code, user_agent):
+    try:
+        _resolve_115_url(cache_key, pick_code, user_agent, refresh=True)
+    finally:
+        with _url_refresh_lock:
+            _url_refreshing.discard(cache_key)
+
+def _resolve_115_url(cache_key, pick_code, user_agent, refresh=False):
+    """
+    真正向 115 请求直链并写入缓存，由 _get_cached_115_url 保证同一 key 同时只有一个调用者进入；
+    refresh=True 为后台续期，跳过缓存复查，直接换取新直链覆盖旧条目
+    """
     # =================================================================
     # ★ 智能识别 Emby 后台刮削 (Lavf/ffmpeg)
     # =================================================================
@@ -605,69 +842,98 @@ def _get_cached_115_url(pick_code, user_agent, client_ip=None):
         if not api_limiter.consume():
             return None # 静默拦截，防止 2 万集并发把日志撑爆
     
-    client = P115Service.get_client()
+    client = _cached_client()
     if not client: 
-        _url_cache[cache_key] = {"url": None, "name": pick_code, "expire_at": now + 10}
+        _cache_negative_115_url(cache_key, pick_code)
         return None
     
-    # 使用锁：即使并发进来，也只有一个能去查 115 API
-    with fetch_lock:
-        now = time.time()
-        if cache_key in _url_cache and now < _url_cache[cache_key]["expire_at"]:
-            return _url_cache[cache_key]["url"]
-            
+    # 同一 key 的并发请求已由 _get_cached_115_url 的 singleflight 合并；不同 pick_code 的直链请求
+    # 最终都要排队经过 P115Service 的全局直链锁 (>=1.5 秒间隔)，这里不再额外加锁
+    # 复查缓存：上一个 leader 可能刚写入缓存并退出合并表
+    if not refresh:
         try:
-            time.sleep(0.1) 
-            
-            url_obj = client.download_url(pick_code, user_agent=user_agent)
-            direct_url = str(url_obj) if url_obj else None
-            
-            if direct_url:
-                display_name = pick_code[:8] + "..."
-                try:
-                    from urllib.parse import urlparse, parse_qs, unquote
-                    parsed = urlparse(direct_url)
-                    qs = parse_qs(parsed.query)
-                    if 'file' in qs: display_name = unquote(qs['file'][0])
-                    elif 'filename' in qs: display_name = unquote(qs['filename'][0])
-                    else:
-                        path_name = unquote(os.path.basename(parsed.path))
-                        if path_name: display_name = path_name
-                except: pass
+            return _url_cache[cache_key]["url"]
+        except KeyError:
+            pass
+        
+    try:
+        time.sleep(0.1) 
+        
+        url_obj = client.download_url(pick_code, user_agent=user_agent)
+        direct_url = str(url_obj) if url_obj else None
+        
+        if direct_url:
+            display_name = _url_obj_name(url_obj) or _extract_name(direct_url) or pick_code[:8] + "..."
 
-                # 定制化日志输出
-                if is_scanner:
-                    logger.info(f"  🎬 [115直链] 提取媒体信息 -> {display_name}")
-                else:
-                    logger.info(f"  ▶️ [115直链] 用户正在播放 -> {display_name}")
-                
-                _url_cache[cache_key] = {"url": direct_url, "name": display_name, "expire_at": now + 7200}
-                return direct_url
+            # 定制化日志输出
+            if refresh:
+                logger.debug("  🔄 [115直链] 后台续期 -> %s", display_name)
+            elif is_scanner:
+                logger.info(f"  🎬 [115直链] 提取媒体信息 -> {display_name}")
             else:
-                _url_cache[cache_key] = {"url": None, "name": pick_code, "expire_at": now + 10}
-                return None
-        except Exception as e:
-            logger.error(f"  ❌ 获取 115 直链 API 报错: {e}")
-            _url_cache[cache_key] = {"url": None, "name": pick_code, "expire_at": now + 10}
+                logger.info(f"  ▶️ [115直链] 用户正在播放 -> {display_name}")
+            
+            with _url_cache_lock:
+                _url_cache[cache_key] = {
+                    "url": direct_url, "name": display_name,
+                    "expire_at": time.monotonic() + URL_CACHE_TTL,
+                }
+                _url_negative_cache.pop(cache_key, None)
+            return direct_url
+        else:
+            _cache_negative_115_url(cache_key, pick_code)
             return None
+    except Exception as e:
+        logger.error(f"  ❌ 获取 115 直链 API 报错: {e}")
+        _cache_negative_115_url(cache_key, pick_code)
+        return None
+
+def _url_obj_name(url_obj):
+    """
+    p115client 返回的直链对象 (P115URL) 本身就带有文件名属性，直接读取即可，
+    取不到 (旧版本或纯字符串) 时返回 None，由调用方退回到解析 URL。
+    """
+    try:
+        name = getattr(url_obj, 'name', None) or getattr(url_obj, 'filename', None)
+    except Exception:
+        return None
+    return name if isinstance(name, str) and name else None
+
+# 直链 URL 中的文件名参数 (file 优先于 filename)
+_URL_FILE_PARAM_RE = re.compile(r'[?&]file=([^&#]+)')
+_URL_FILENAME_PARAM_RE = re.compile(r'[?&]filename=([^&#]+)')
 
-# 保留原来的 lru_cache 装饰器作为备用（用于 play_115_video 直接调用）
-@lru_cache(maxsize=2048)
-def _get_cached_115_url_legacy(pick_code, user_agent, client_ip=None):
+def _extract_name(url):
     """
-    带缓存的 115 直链获取器（旧版本，保留兼容性）
+    从 115 直链中提取用于日志展示的文件名：只切出 file/filename 参数本身，不做整串 parse_qs；
+    都没有时退回 URL 路径的最后一段，仍取不到返回 None。
     """
-    return _get_cached_115_url(pick_code, user_agent, client_ip)
+    try:
+        m = _URL_FILE_PARAM_RE.search(url) or _URL_FILENAME_PARAM_RE.search(url)
+        if m:
+            return unquote_plus(m.group(1))
+        return unquote(os.path.basename(urlparse(url).path)) or None
+    except Exception:
+        return None
+
+def _cache_negative_115_url(cache_key, pick_code):
+    """记录一次获取失败，URL_NEGATIVE_CACHE_TTL 秒内同一 key 直接返回 None"""
+    with _url_cache_lock:
+        _url_negative_cache[cache_key] = {"url": None, "name": pick_code}
+
+_PLAY_PATH_PREFIX = '/api/p115/play/'
 
-@p115_bp.route('/play/<pick_code>', methods=['GET', 'HEAD']) # 允许 HEAD 请求，加速客户端嗅探
+@p115_bp.before_request
+def _short_circuit_play_head():
+    """播放器 (Infuse/VLC 等) 常在 GET 前先发 HEAD 嗅探：在进入视图前直接应答，不触发直链解析"""
+    if request.method == 'HEAD' and request.path.startswith(_PLAY_PATH_PREFIX):
+        return '', 200, {'Cache-Control': 'no-cache'}
+
+@p115_bp.route('/play/<pick_code>', methods=['GET', 'HEAD']) # 允许 HEAD 请求，加速客户端嗅探 (由 before_request 直接应答)
 def play_115_video(pick_code):
     """
     终极极速 302 直链解析服务 (带内存缓存版)
     """
-    if request.method == 'HEAD':
-        # HEAD 请求通常是播放器嗅探，直接返回 200 或简单处理，不触发解析
-        return '', 200
-
     try:
         player_ua = request.headers.get('User-Agent', 'Mozilla/5.0')
         
@@ -684,6 +950,60 @@ def play_115_video(pick_code):
         logger.error(f"  ❌ 直链解析发生异常: {e}")
         return str(e), 500
     
+def _iter_strm_files(root):
+    """
+    递归列出目录下所有 .strm 文件路径。
+    基于 os.scandir：目录项类型直接取自 readdir 结果，无需像 os.walk 那样为每个条目额外 stat，
+    且按需产出路径，不在内存里堆积整棵目录树。
+    """
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith('.strm') and entry.is_file():
+                            yield entry.path
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"  ⚠️ 无法读取目录 {current}: {e}")
+
+def _process_strm_file(file_path, etk_url):
+    """
+    修正单个 .strm 文件，返回 (修正数, 跳过数)；读写失败时记录日志并返回 (0, 0)。
+    """
+    try:
+        # 以二进制读取：strm 内容几乎都是纯 ASCII 的 URL，ASCII 解码是直接拷贝，
+        # 只有含非 ASCII 字符 (如中文路径) 时才走完整的 UTF-8 解码
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+        try:
+            content = raw.decode('ascii').strip()
+        except UnicodeDecodeError:
+            content = raw.decode('utf-8').strip()
+        
+        # ★ 调用公共函数进行解析和转换
+        needs_update, new_content = convert_strm_content_to_etk(content, etk_url)
+        
+        if needs_update and new_content:
+            with open(file_path, 'wb') as f:
+                f.write(new_content.encode('utf-8'))
+            return 1, 0
+        elif new_content is None:
+            logger.warning(f"  ⚠️ 无法识别该 strm 格式，已跳过: {file_path}")
+            return 0, 1
+        else:
+            # 已经是标准格式，无需修改
+            return 0, 1
+            
+    except Exception as e:
+        logger.error(f"  ❌ 处理文件 {file_path} 失败: {e}")
+        return 0, 0
+
 @p115_bp.route('/fix_strm', methods=['POST'])
 @admin_required
 def fix_strm_files():
@@ -701,31 +1021,14 @@ def fix_strm_files():
     skipped_count = 0
     
     try:
-        # 递归遍历整个本地 STRM 目录
-        for root_dir, _, files in os.walk(local_root):
-            for file in files:
-                if file.endswith('.strm'):
-                    file_path = os.path.join(root_dir, file)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            content = f.read().strip()
-                        
-                        # ★ 调用公共函数进行解析和转换
-                        needs_update, new_content = convert_strm_content_to_etk(content, etk_url)
-                        
-                        if needs_update and new_content:
-                            with open(file_path, 'w', encoding='utf-8') as f:
-                                f.write(new_content)
-                            fixed_count += 1
-                        elif new_content is None:
-                            logger.warning(f"  ⚠️ 无法识别该 strm 格式，已跳过: {file_path}")
-                            skipped_count += 1
-                        else:
-                            # 已经是标准格式，无需修改
-                            skipped_count += 1
-                            
-                    except Exception as e:
-                        logger.error(f"  ❌ 处理文件 {file_path} 失败: {e}")
+        # 递归遍历整个本地 STRM 目录：边遍历边处理，不在内存里堆积路径列表
+        # (进程已被 gevent monkey patch，且转换过程会写日志，日志锁不能跨原生线程使用，因此顺序处理)
+        for done, path in enumerate(_iter_strm_files(local_root), 1):
+            fixed, skipped = _process_strm_file(path, etk_url)
+            fixed_count += fixed
+            skipped_count += skipped
+            if done % 5000 == 0:
+                logger.info(f"  ➜ [STRM修正] 已处理 {done} 个文件...")
         
         msg = f"转换完毕！成功修正了 {fixed_count} 个文件"
         if skipped_count > 0:
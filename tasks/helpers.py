@@ -1639,6 +1639,18 @@ def translate_tmdb_metadata_recursively(
         logger.info(f"  ➜ [AI翻译] 本次新翻译了 {translated_count} 条数据 ({item_name})。")
 
 # --- 第三方 strm 内容解析与转换 ---
+# google-re2 为可选依赖：基于 DFA，匹配耗时与文本长度线性相关；缺失时使用标准库 re (接口一致)
+try:
+    import re2 as _strm_re
+except ImportError:
+    _strm_re = re
+
+# 第三方 STRM 链接中提取 pick_code 的预编译正则 (批量修正时每个文件都会调用，避免逐次解析模式)
+# 大小写不敏感用内联 (?i)，re 与 re2 均支持
+_STRM_PICKCODE_RE = _strm_re.compile(r'(?i)pick_?code=([a-zA-Z0-9]+)')
+_STRM_CMS_RE = _strm_re.compile(r'/d/([a-zA-Z0-9]+)(?:[.?/]|$)')
+_STRM_FILEID_RE = _strm_re.compile(r'(?i)fileid=([a-zA-Z0-9]+)')
+
 def convert_strm_content_to_etk(content: str, etk_url: str) -> Tuple[bool, Optional[str]]:
     """
     解析第三方 strm 内容并转换为 ETK 标准格式。
@@ -1652,33 +1664,33 @@ def convert_strm_content_to_etk(content: str, etk_url: str) -> Tuple[bool, Optio
         return False, None
 
     pick_code = None
+    match = None
 
     # 模式 1: ETK 现在的标准格式
     if '/api/p115/play/' in content:
-        pick_code = content.split('/api/p115/play/')[-1].split('?')[0].strip()
+        # rpartition/partition 只切一刀，不像 split 那样生成整个列表
+        pick_code = content.rpartition('/api/p115/play/')[2].partition('?')[0].strip()
         # 检查是否已经是完全一致的标准格式
         expected_url = f"{etk_url}/api/p115/play/{pick_code}"
         if content == expected_url:
             return False, content
 
-    # 模式 2: MoviePilot P115StrmHelper 插件格式 
-    elif 'pickcode=' in content.lower() or 'pick_code=' in content.lower():
-        match = re.search(r'pick_?code=([a-zA-Z0-9]+)', content, re.IGNORECASE)
-        if match:
-            pick_code = match.group(1)
+    else:
+        lowered = content.lower()
 
-    # 模式 3: CMS 生成的格式
-    elif '/d/' in content:
-        match = re.search(r'/d/([a-zA-Z0-9]+)[.?/]', content)
-        if not match:
-            match = re.search(r'/d/([a-zA-Z0-9]+)$', content)
-        if match:
-            pick_code = match.group(1)
+        # 模式 2: MoviePilot P115StrmHelper 插件格式 
+        if 'pickcode=' in lowered or 'pick_code=' in lowered:
+            match = _STRM_PICKCODE_RE.search(content)
+
+        # 模式 3: CMS 生成的格式 (/d/<pick_code> 后接 . ? / 或位于末尾)
+        elif '/d/' in content:
+            match = _STRM_CMS_RE.search(content)
+
+        # --- 新增 模式 4: MH  格式 ---
+        # 示例: http://.../videoPlayUrl?fileId=bd7m16whkjpg48w4r&account=...
+        elif 'fileid=' in lowered:
+            match = _STRM_FILEID_RE.search(content)
 
-    # --- 新增 模式 4: MH  格式 ---
-    # 示例: http://.../videoPlayUrl?fileId=bd7m16whkjpg48w4r&account=...
-    elif 'fileid=' in content.lower():
-        match = re.search(r'fileid=([a-zA-Z0-9]+)', content, re.IGNORECASE)
         if match:
             pick_code = match.group(1)
 
@@ -76,6 +76,39 @@ logger = logging.getLogger(__name__)
 logging.getLogger("apscheduler.scheduler").setLevel(logging.WARNING)
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
 app = Flask(__name__, static_folder='static')
+
+# orjson 为可选依赖：替换 Flask 默认的 JSON provider，所有 jsonify / request.json 走 orjson
+# 日期、UUID 等类型仍交给 Flask 原有的 default 处理，输出格式不变；orjson 无法处理的情况回退到标准库
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+        def dumps(self, obj, **kwargs):
+            # response() 在非 debug 模式只会传 separators (紧凑输出)，与 orjson 默认一致；其它参数交给标准库
+            kwargs.pop('separators', None)
+            if kwargs:
+                return super().dumps(obj, **kwargs)
+            option = self._OPTIONS | orjson.OPT_SORT_KEYS if self.sort_keys else self._OPTIONS
+            try:
+                return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+            except TypeError:
+                return super().dumps(obj, separators=(',', ':'))
+
+        def loads(self, s, **kwargs):
+            if kwargs:
+                return super().loads(s, **kwargs)
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # 标准库额外接受 NaN/Infinity 等非标准写法，保持兼容
+                return super().loads(s)
+
+    app.json = OrjsonProvider(app)
+except ImportError:
+    pass
 # --- 优化 Session 密钥持久化 ---
 secret_file_path = os.path.join(config_manager.PERSISTENT_DATA_PATH, '.flask_secret')
 if os.path.exists(secret_file_path):